@@ -0,0 +1,187 @@
+# benchmark.py
+"""Replay synthetic updates through the dispatcher and report latency and query counts.
+
+Runs offline: Bot API calls are answered by a fake session and the database
+defaults to a throwaway SQLite file.
+
+Usage:
+	python benchmark.py [--students 200] [--files 3] [--concurrency 20]
+	                    [--database sqlite+aiosqlite:///benchmark.sqlite] [--reset]
+
+Scenarios run in order (each builds on the previous one's data):
+registration, submission (document bursts), review (page clicks), grading.
+queries/u counts every statement executed during a scenario, including
+background work it triggers (FSM flushes, file downloads).
+"""
+import argparse
+import asyncio
+import math
+import os
+import sys
+import time
+
+DEFAULT_DATABASE = "sqlite+aiosqlite:///benchmark.sqlite"
+
+TEACHER_ID = 900000000
+GROUP_CODE = "benchmark"
+STUDENT_BASE_ID = 910000000
+
+
+def parse_args(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+	parser.add_argument("--students", type=int, default=200)
+	parser.add_argument("--files", type=int, default=3, help="documents per submission")
+	parser.add_argument("--concurrency", type=int, default=20, help="users replayed in parallel")
+	parser.add_argument("--database", default=os.getenv("BENCHMARK_DATABASE_URL", DEFAULT_DATABASE))
+	parser.add_argument("--reset", action="store_true", help="drop and recreate all tables first (PostgreSQL)")
+	return parser.parse_args(argv)
+
+
+ARGS = parse_args()
+
+# Configure the app before it is imported: local database, no send or per-user rate limits
+os.environ["DATABASE_URL"] = ARGS.database
+os.environ.setdefault("SEND_GLOBAL_RATE", "1000000")
+os.environ.setdefault("SEND_CHAT_RATE", "1000000")
+os.environ.setdefault("SEND_CHAT_BURST", "1000000")
+for profile in ("", "UPLOAD_", "DOWNLOAD_"):
+	os.environ.setdefault(f"THROTTLE_{profile}RATE", "1000000")
+	os.environ.setdefault(f"THROTTLE_{profile}BURST", "1000000")
+os.environ.setdefault("HOMEWORK_NOTIFY", "0")
+os.environ.setdefault("FILE_STORE_DIR", "benchmark_files")
+
+from sqlalchemy import event, select  # noqa: E402
+
+import main  # noqa: E402
+from callbacks import GradeSubmission, MissingPage, ReviewPage  # noqa: E402
+from database import Base, engine, async_session  # noqa: E402
+from fake_telegram import FakeSession, callback, document, message  # noqa: E402
+from model import Group, Submission, Teacher  # noqa: E402
+
+
+class QueryCounter:
+	def __init__(self, sync_engine):
+		self.count = 0
+		event.listen(sync_engine, "after_cursor_execute", self._count)
+
+	def _count(self, *args):
+		self.count += 1
+
+
+def percentile(values, p):
+	ordered = sorted(values)
+	return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+async def replay(name, streams, concurrency, counter):
+	"""Feed each stream in order; streams run in parallel up to ``concurrency``."""
+	latencies = []
+	semaphore = asyncio.Semaphore(concurrency)
+
+	async def run(stream):
+		async with semaphore:
+			for update in stream:
+				started = time.perf_counter()
+				await main.dp.feed_update(main.bot, update)
+				latencies.append(time.perf_counter() - started)
+
+	queries_before = counter.count
+	started = time.perf_counter()
+	await asyncio.gather(*(run(stream) for stream in streams))
+	elapsed = time.perf_counter() - started
+	queries = counter.count - queries_before
+
+	if not latencies:
+		print(f"{name:<13} no updates")
+		return
+	print(
+		f"{name:<13} {len(latencies):>7} {len(latencies) / elapsed:>10.1f} "
+		f"{percentile(latencies, 50) * 1000:>8.2f} {percentile(latencies, 95) * 1000:>8.2f} "
+		f"{percentile(latencies, 99) * 1000:>8.2f} {queries / len(latencies):>9.2f}"
+	)
+
+
+async def prepare_database(reset):
+	if engine.dialect.name == "sqlite" or reset:
+		async with engine.begin() as conn:
+			await conn.run_sync(Base.metadata.drop_all)
+	await main.create_tables()
+	async with async_session() as session:
+		teacher = (await session.execute(select(Teacher).where(Teacher.telegram_id == str(TEACHER_ID)))).scalar_one_or_none()
+		if teacher is None:
+			teacher = Teacher(telegram_id=str(TEACHER_ID), name="Benchmark")
+			session.add(teacher)
+			await session.flush()
+			# Students join it during registration, which gives them the teacher's homework
+			session.add(Group(teacher_id=teacher.id, name="Benchmark", code=GROUP_CODE))
+			await session.commit()
+
+
+async def submission_ids():
+	async with async_session() as session:
+		result = await session.execute(select(Submission.id).order_by(Submission.id))
+		return result.scalars().all()
+
+
+async def run_benchmark(args):
+	main.bot.session = FakeSession(default_content=b"benchmark submission\n" * 64)
+	# Time each update until its handler finished, not just until it was queued
+	main.update_queue.wait_for_result = True
+	main.dp.include_router(main.router)
+	counter = QueryCounter(engine.sync_engine)
+	await prepare_database(args.reset)
+
+	# The teacher publishes the homework the students submit to
+	for update in (
+			message(TEACHER_ID, "Создать домашнее задание"),
+			message(TEACHER_ID, "Benchmark homework"),
+			message(TEACHER_ID, "2099-01-01 10:00"),
+	):
+		await main.dp.feed_update(main.bot, update)
+
+	students = [STUDENT_BASE_ID + i for i in range(args.students)]
+	print(f"{'scenario':<13} {'updates':>7} {'updates/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries/u':>9}")
+
+	await replay("registration", [
+		[
+			message(uid, "/start"),
+			message(uid, contact={"phone_number": f"+{uid}", "first_name": "B", "user_id": uid}),
+			message(uid, f"Student{uid} Benchmark"),
+			message(uid, f"/join {GROUP_CODE}"),
+		]
+		for uid in students
+	], args.concurrency, counter)
+
+	await replay("submission", [
+		[
+			message(uid, "Отправить решение"),
+			*(document(uid, f"solution_{n}.py") for n in range(args.files)),
+			message(uid, "Завершить отправку"),
+		]
+		for uid in students
+	], args.concurrency, counter)
+	await main.file_store.close()
+
+	async with async_session() as session:
+		teacher = (await session.execute(select(Teacher).where(Teacher.telegram_id == str(TEACHER_ID)))).scalar_one()
+	homework = (await main.active_homeworks.for_teacher(teacher.id))[0]
+	await replay("review", [
+		[callback(TEACHER_ID, ReviewPage(hw=homework.id).pack())],
+		[callback(TEACHER_ID, MissingPage(hw=homework.id).pack())],
+	] * max(1, args.students // 10), args.concurrency, counter)
+
+	# One teacher grades sequentially: each grade is a button click and a reply
+	await replay("grading", [[
+		update
+		for submission_id in await submission_ids()
+		for update in (callback(TEACHER_ID, GradeSubmission(id=submission_id).pack()), message(TEACHER_ID, "5"))
+	]], args.concurrency, counter)
+
+	await main.sender.close()
+	if hasattr(main.storage, "close"):
+		await main.storage.close()
+	await engine.dispose()
+
+
+if __name__ == "__main__":
+	sys.exit(asyncio.run(run_benchmark(ARGS)))
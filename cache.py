@@ -0,0 +1,202 @@
+# cache.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select, text
+
+from config import ROLE_CACHE_TTL, ROLE_CACHE_SIZE, HOMEWORK_NOTIFY, ACTIVE_HOMEWORK_MAX_AGE, GROUP_CACHE_TTL
+from database import async_session
+from model import Teacher, Student, Homework, Group, GroupMember
+
+MISSING = object()
+
+
+class TTLCache:
+	"""LRU cache whose entries expire ``ttl`` seconds after they were stored."""
+
+	def __init__(self, maxsize: int, ttl: float):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self._data = OrderedDict()
+
+	def get(self, key, default=MISSING):
+		item = self._data.get(key)
+		if item is None:
+			return default
+		expires_at, value = item
+		if expires_at < time.monotonic():
+			del self._data[key]
+			return default
+		self._data.move_to_end(key)
+		return value
+
+	def set(self, key, value):
+		self._data[key] = (time.monotonic() + self.ttl, value)
+		self._data.move_to_end(key)
+		while len(self._data) > self.maxsize:
+			self._data.popitem(last=False)
+
+	def invalidate(self, key):
+		self._data.pop(key, None)
+
+	def clear(self):
+		self._data.clear()
+
+	def __len__(self):
+		return len(self._data)
+
+
+# telegram_id -> (Teacher | None, Student | None), detached snapshots
+role_cache = TTLCache(ROLE_CACHE_SIZE, ROLE_CACHE_TTL)
+
+
+async def get_roles(telegram_id):
+	"""Return the (teacher, student) registered under a Telegram user id.
+
+	On a cache miss both are loaded in a short-lived session of their own, so
+	the cached rows are detached and no rollback or close of an update's session
+	can expire them. They are read-only snapshots: a handler that changes one
+	loads it with ``session.get()`` by id.
+	"""
+	telegram_id = str(telegram_id)
+	roles = role_cache.get(telegram_id)
+	if roles is not MISSING:
+		return roles
+
+	async with async_session() as session:
+		teacher_query = await session.execute(select(Teacher).where(Teacher.telegram_id == telegram_id))
+		teacher = teacher_query.scalar_one_or_none()
+		student_query = await session.execute(select(Student).where(Student.telegram_id == telegram_id))
+		student = student_query.scalar_one_or_none()
+
+	roles = (teacher, student)
+	role_cache.set(telegram_id, roles)
+	return roles
+
+
+# student id -> tuple of (group id, teacher id)
+group_cache = TTLCache(ROLE_CACHE_SIZE, GROUP_CACHE_TTL)
+
+
+async def get_student_groups(student_id):
+	"""(group id, teacher id) of every group a student belongs to."""
+	memberships = group_cache.get(student_id)
+	if memberships is not MISSING:
+		return memberships
+
+	async with async_session() as session:
+		groups_query = await session.execute(
+			select(GroupMember.group_id, Group.teacher_id)
+			.join(Group, Group.id == GroupMember.group_id)
+			.where(GroupMember.student_id == student_id)
+		)
+		memberships = tuple(tuple(row) for row in groups_query)
+
+	group_cache.set(student_id, memberships)
+	return memberships
+
+
+class ActiveHomeworkRegistry:
+	"""Active homework per group and teacher, loaded once and refreshed when homework changes.
+
+	Handlers that change ``Homework.active`` call :meth:`notify` before committing
+	and :meth:`refresh` after it; on PostgreSQL the notification makes the other
+	workers listening on ``channel`` refresh too. ``max_age`` bounds staleness
+	when notifications are unavailable.
+	"""
+
+	channel = "homework_changed"
+
+	def __init__(self, max_age: float = ACTIVE_HOMEWORK_MAX_AGE):
+		self.max_age = max_age
+		self._by_id = None
+		self._by_group = {}
+		self._by_teacher = {}
+		self._loaded_at = 0.0
+		self._lock = asyncio.Lock()
+		self._listen_connection = None
+		self._refresh_task = None
+
+	async def refresh(self):
+		"""Reload all active homework from the database."""
+		async with async_session() as session:
+			homework_query = await session.execute(
+				select(Homework).where(Homework.active == 1).order_by(Homework.id)
+			)
+			by_id, by_group, by_teacher = {}, {}, {}
+			for homework in homework_query.scalars():
+				by_id[homework.id] = homework
+				# Homework without a group is keyed by (None, teacher) so teachers do not collide
+				group_key = homework.group_id if homework.group_id is not None else (None, homework.teacher_id)
+				by_group.setdefault(group_key, homework)
+				by_teacher.setdefault(homework.teacher_id, []).append(homework)
+		self._by_id, self._by_group, self._by_teacher = by_id, by_group, by_teacher
+		self._loaded_at = time.monotonic()
+
+	async def _ensure_loaded(self):
+		if self._by_id is not None and time.monotonic() - self._loaded_at < self.max_age:
+			return
+		async with self._lock:
+			if self._by_id is None or time.monotonic() - self._loaded_at >= self.max_age:
+				await self.refresh()
+
+	async def get(self, homework_id):
+		"""The homework if it is still active."""
+		await self._ensure_loaded()
+		return self._by_id.get(homework_id)
+
+	async def for_teacher(self, teacher_id):
+		"""All active homework of a teacher, one per group."""
+		await self._ensure_loaded()
+		return self._by_teacher.get(teacher_id, [])
+
+	async def for_groups(self, memberships):
+		"""Active homework visible to members of ``memberships`` (group id, teacher id), earliest deadline first.
+
+		Homework created without a group goes to the students of all its
+		teacher's groups; students outside any group see no homework.
+		"""
+		await self._ensure_loaded()
+		homeworks = {}
+		for group_id, teacher_id in memberships:
+			for key in (group_id, (None, teacher_id)):
+				homework = self._by_group.get(key)
+				if homework is not None:
+					homeworks[homework.id] = homework
+		return sorted(homeworks.values(), key=lambda homework: homework.deadline)
+
+	async def for_student_all(self, student_id):
+		"""All active homework visible to a student."""
+		return await self.for_groups(await get_student_groups(student_id))
+
+	async def notify(self, session):
+		"""Tell other workers to refresh once ``session`` commits (PostgreSQL only)."""
+		if HOMEWORK_NOTIFY and session.bind.dialect.name == "postgresql":
+			await session.execute(text("SELECT pg_notify(:channel, '')"), {"channel": self.channel})
+
+	async def listen(self, engine):
+		"""Subscribe to change notifications from other workers (PostgreSQL only)."""
+		if not HOMEWORK_NOTIFY or engine.dialect.name != "postgresql":
+			return
+		self._listen_connection = await engine.connect()
+		raw_connection = await self._listen_connection.get_raw_connection()
+
+		def on_notify(connection, pid, channel, payload):
+			self._refresh_task = asyncio.get_running_loop().create_task(self.refresh())
+
+		await raw_connection.driver_connection.add_listener(self.channel, on_notify)
+		logging.info("Listening for %s notifications", self.channel)
+
+	async def close(self):
+		"""Release the LISTEN connection and wait for a refresh it started."""
+		if self._listen_connection is not None:
+			await self._listen_connection.close()
+			self._listen_connection = None
+		if self._refresh_task is not None:
+			await asyncio.gather(self._refresh_task, return_exceptions=True)
+			self._refresh_task = None
+
+
+active_homeworks = ActiveHomeworkRegistry()
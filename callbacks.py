@@ -0,0 +1,45 @@
+# callbacks.py
+"""Inline button payloads.
+
+Packed as ``prefix:field:...`` strings by aiogram, so a press is dispatched by
+prefix without JSON parsing and stays well under Telegram's 64-byte limit.
+"""
+from typing import Optional
+
+from aiogram.filters.callback_data import CallbackData
+
+
+class SelectSubmission(CallbackData, prefix="sel"):
+	id: int
+
+
+class GradeSubmission(CallbackData, prefix="grd"):
+	id: int
+
+
+class DownloadSubmission(CallbackData, prefix="dl"):
+	id: int
+
+
+class ReviewPage(CallbackData, prefix="rp"):
+	"""Page of submissions; ``after``/``before`` are keyset cursors over Submission.id."""
+	hw: int
+	after: Optional[int] = None
+	before: Optional[int] = None
+
+
+class MissingPage(CallbackData, prefix="mp"):
+	"""Page of students without a submission; cursors are over Student.id."""
+	hw: int
+	after: Optional[int] = None
+	before: Optional[int] = None
+
+
+class HomeworkGroup(CallbackData, prefix="hg"):
+	"""Group chosen for a new homework."""
+	id: int
+
+
+class SubmitHomework(CallbackData, prefix="sh"):
+	"""Homework a student chose to submit to."""
+	id: int
@@ -11,4 +11,129 @@ DATABASE_URL = os.getenv("DATABASE_URL", default='postgres://postgres:123rasulQq
 
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN', '7550488248:AAGlTub1djRHzFgPqVrt-J78_65d5aBh1ng')
 
-API_URL = os.getenv('API_URL')
\ No newline at end of file
+API_URL = os.getenv('API_URL')
+
+
+# Webhook mode (RUN_MODE=webhook) instead of long polling
+RUN_MODE = os.getenv('RUN_MODE', 'polling')
+
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+# Required in webhook mode; Telegram sends it with every update
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', 8080))
+
+
+# FSM storage: "sql" (shared, persistent) or "memory"
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sql')
+FSM_STATE_TTL = int(os.getenv('FSM_STATE_TTL', 7 * 24 * 3600))
+# Seconds data-only FSM writes are buffered; state changes are always written at once.
+# Other workers see buffered data late, so use 0 unless updates are routed per user.
+FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', 0.5))
+FSM_MAX_PENDING = int(os.getenv('FSM_MAX_PENDING', 1000))
+
+
+# Teacher/Student lookup cache
+ROLE_CACHE_TTL = float(os.getenv('ROLE_CACHE_TTL', 300))
+ROLE_CACHE_SIZE = int(os.getenv('ROLE_CACHE_SIZE', 10000))
+
+
+# Active homework registry: refresh across workers via PostgreSQL LISTEN/NOTIFY
+HOMEWORK_NOTIFY = os.getenv('HOMEWORK_NOTIFY', '1') == '1'
+ACTIVE_HOMEWORK_MAX_AGE = float(os.getenv('ACTIVE_HOMEWORK_MAX_AGE', 300))
+
+
+# Review screen: submissions/students per page
+REVIEW_PAGE_SIZE = int(os.getenv('REVIEW_PAGE_SIZE', 10))
+
+
+# Outbound Telegram calls: messages per second overall and per chat
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', 30))
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', 1))
+SEND_CHAT_BURST = int(os.getenv('SEND_CHAT_BURST', 3))
+SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', 3))
+SEND_WORKERS = int(os.getenv('SEND_WORKERS', 4))
+SEND_QUEUE_SIZE = int(os.getenv('SEND_QUEUE_SIZE', 10000))
+# Part of the queue fan-outs (reminders) may fill; the rest stays free for notifications
+SEND_BULK_QUEUE_SIZE = int(os.getenv('SEND_BULK_QUEUE_SIZE', 2000))
+# Seconds to wait for queued calls on shutdown
+SEND_DRAIN_TIMEOUT = float(os.getenv('SEND_DRAIN_TIMEOUT', 30))
+
+
+# Downloaded submission files, stored by SHA-256 under FILE_STORE_DIR/ab/cd/<sha256>
+FILE_STORE_DIR = os.getenv('FILE_STORE_DIR', 'submissions')
+FILE_STORE_WORKERS = int(os.getenv('FILE_STORE_WORKERS', 4))
+
+
+# /leaderboard: rows shown and seconds the rendered top is cached
+LEADERBOARD_SIZE = int(os.getenv('LEADERBOARD_SIZE', 10))
+LEADERBOARD_TTL = float(os.getenv('LEADERBOARD_TTL', 60))
+# Leaderboards cached at once; there is one per teacher and per set of groups
+LEADERBOARD_CACHE_SIZE = int(os.getenv('LEADERBOARD_CACHE_SIZE', 1000))
+
+
+# Deadline scheduler: reload pending jobs this often (s); reminder recipients per DB batch
+SCHEDULER_RESYNC_INTERVAL = float(os.getenv('SCHEDULER_RESYNC_INTERVAL', 300))
+REMINDER_BATCH_SIZE = int(os.getenv('REMINDER_BATCH_SIZE', 500))
+
+
+# Student -> groups membership cache
+GROUP_CACHE_TTL = float(os.getenv('GROUP_CACHE_TTL', 300))
+
+
+# GET /metrics (Prometheus text format) on a local port; 0 disables the endpoint
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9100))
+
+
+# Logging: level name, "json" or "text" output; DB_ECHO=1 logs every SQL statement
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+DB_ECHO = os.getenv('DB_ECHO', '0') == '1'
+
+
+# Database engine and connection pool
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+# asyncpg: prepared statements cached per connection; seconds before a query is cancelled
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 100))
+DB_COMMAND_TIMEOUT = float(os.getenv('DB_COMMAND_TIMEOUT', 30))
+# Seconds the startup connection check may take before the bot refuses to start
+DB_CONNECT_TIMEOUT = float(os.getenv('DB_CONNECT_TIMEOUT', 10))
+
+
+# Incoming update throttling per user: tokens per second and burst, by handler profile
+THROTTLE_RATE = float(os.getenv('THROTTLE_RATE', 1))
+THROTTLE_BURST = int(os.getenv('THROTTLE_BURST', 5))
+THROTTLE_UPLOAD_RATE = float(os.getenv('THROTTLE_UPLOAD_RATE', 1))
+THROTTLE_UPLOAD_BURST = int(os.getenv('THROTTLE_UPLOAD_BURST', 10))
+THROTTLE_DOWNLOAD_RATE = float(os.getenv('THROTTLE_DOWNLOAD_RATE', 0.2))
+THROTTLE_DOWNLOAD_BURST = int(os.getenv('THROTTLE_DOWNLOAD_BURST', 3))
+THROTTLE_MAX_KEYS = int(os.getenv('THROTTLE_MAX_KEYS', 100000))
+
+
+# Largest CSV file accepted by bulk grading
+GRADES_MAX_FILE_SIZE = int(os.getenv('GRADES_MAX_FILE_SIZE', 1024 * 1024))
+
+
+# Roster import (/import) and CSV export (/export)
+ROSTER_MAX_FILE_SIZE = int(os.getenv('ROSTER_MAX_FILE_SIZE', 5 * 1024 * 1024))
+ROSTER_BATCH_SIZE = int(os.getenv('ROSTER_BATCH_SIZE', 500))
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 500))
+
+
+# Seconds to collect the documents of one album before storing them as a batch
+MEDIA_GROUP_WINDOW = float(os.getenv('MEDIA_GROUP_WINDOW', 0.5))
+
+
+# Update processing: concurrent handlers, queued updates per user and in total
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', 64))
+UPDATE_USER_QUEUE_SIZE = int(os.getenv('UPDATE_USER_QUEUE_SIZE', 100))
+UPDATE_MAX_PENDING = int(os.getenv('UPDATE_MAX_PENDING', 10000))
+# Seconds to wait for queued updates on shutdown
+UPDATE_DRAIN_TIMEOUT = float(os.getenv('UPDATE_DRAIN_TIMEOUT', 30))
@@ -0,0 +1,75 @@
+# fake_telegram.py
+"""An offline Bot API and synthetic updates, shared by benchmark.py and the tests."""
+import asyncio
+import itertools
+import time
+
+from aiogram import types
+from aiogram.client.session.base import BaseSession
+
+# file_id -> content served when the bot downloads that file
+FILES = {}
+
+_ids = itertools.count(1)
+
+
+class FakeSession(BaseSession):
+	"""Answers every Bot API call locally with a minimal valid result and records the calls in ``sent``.
+
+	Downloads return the content registered in :data:`FILES`, else ``default_content``.
+	"""
+
+	def __init__(self, default_content: bytes = b"test submission\n"):
+		super().__init__()
+		self.default_content = default_content
+		self.sent = []
+
+	async def close(self):
+		pass
+
+	async def make_request(self, bot, method, timeout=None):
+		await asyncio.sleep(0)
+		self.sent.append(method)
+		name = type(method).__name__
+		message = {"message_id": 1, "date": int(time.time()), "chat": {"id": 1, "type": "private"}, "text": "ok"}
+		if name == "SendMediaGroup":
+			return [types.Message(**message) for _ in method.media]
+		if name == "GetFile":
+			return types.File(file_id=method.file_id, file_unique_id=f"u-{method.file_id}", file_path=f"f/{method.file_id}")
+		if name == "GetMe":
+			return types.User(id=42, is_bot=True, first_name="fake")
+		if method.__returning__ is bool:
+			return True
+		return types.Message(**message)
+
+	async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+		yield FILES.get(url.rsplit("/", 1)[-1], self.default_content)
+
+
+def _user(uid):
+	return {"id": uid, "is_bot": False, "first_name": f"U{uid}", "username": f"user{uid}"}
+
+
+def message(uid, text=None, **extra):
+	payload = {"message_id": next(_ids), "date": int(time.time()), "chat": {"id": uid, "type": "private"}, "from": _user(uid)}
+	if text is not None:
+		payload["text"] = text
+		if text.startswith("/"):
+			payload["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+	payload.update(extra)
+	return types.Update(update_id=next(_ids), message=payload)
+
+
+def document(uid, name, content=None):
+	"""A document message; ``content`` is what downloading the file returns."""
+	file_id = f"doc-{next(_ids)}"
+	if content is not None:
+		FILES[file_id] = content
+	return message(uid, document={"file_id": file_id, "file_unique_id": f"u-{file_id}", "file_name": name, "file_size": 100})
+
+
+def callback(uid, data):
+	return types.Update(update_id=next(_ids), callback_query={
+		"id": str(next(_ids)), "from": _user(uid), "chat_instance": "fake", "data": data,
+		"message": {"message_id": 1, "date": int(time.time()), "chat": {"id": uid, "type": "private"}, "text": "ok"},
+	})
@@ -0,0 +1,116 @@
+# file_store.py
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+
+from aiogram import Bot
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from config import FILE_STORE_DIR, FILE_STORE_WORKERS
+from database import async_session
+from model import FileBlob
+
+
+def _hash_file(path):
+	digest = hashlib.sha256()
+	with open(path, "rb") as file:
+		for chunk in iter(lambda: file.read(1 << 20), b""):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+
+def _place(tmp_path, directory, sha256):
+	"""Move a finished download to its content address; returns (path, size)."""
+	blob_dir = os.path.join(directory, sha256[:2], sha256[2:4])
+	os.makedirs(blob_dir, exist_ok=True)
+	path = os.path.join(blob_dir, sha256)
+	size = os.path.getsize(tmp_path)
+	if os.path.exists(path):
+		os.remove(tmp_path)
+	else:
+		os.replace(tmp_path, path)
+	return path, size
+
+
+class FileStore:
+	"""Background download pool for submitted documents.
+
+	Files are keyed by Telegram's ``file_unique_id`` (already stored ones are
+	never downloaded again) and saved once per SHA-256 under a two-level
+	sharded directory. Downloads go to a temporary name and are renamed into
+	place when complete, so a reader never sees a partial file.
+	"""
+
+	def __init__(self, bot: Bot, directory: str = FILE_STORE_DIR, workers: int = FILE_STORE_WORKERS):
+		self.bot = bot
+		self.directory = directory
+		self.workers = workers
+		self._queue = None
+		self._worker_tasks = []
+		self._inflight = set()
+
+	def submit(self, file_id, file_unique_id):
+		"""Queue a document for download and return immediately."""
+		if file_unique_id in self._inflight:
+			return
+		if self._queue is None:
+			self._queue = asyncio.Queue()
+			self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+		self._inflight.add(file_unique_id)
+		self._queue.put_nowait((file_id, file_unique_id))
+
+	async def _worker(self):
+		while True:
+			file_id, file_unique_id = await self._queue.get()
+			try:
+				await self.store(file_id, file_unique_id)
+			except Exception as e:
+				logging.error("Failed to store file %s: %s", file_unique_id, e)
+			finally:
+				self._inflight.discard(file_unique_id)
+				self._queue.task_done()
+
+	async def store(self, file_id, file_unique_id):
+		"""Download and record a file unless it is already stored."""
+		async with async_session() as session:
+			blob_query = await session.execute(
+				select(FileBlob.id).where(FileBlob.file_unique_id == file_unique_id)
+			)
+			if blob_query.scalar_one_or_none() is not None:
+				return
+
+		tmp_dir = os.path.join(self.directory, "tmp")
+		await asyncio.to_thread(os.makedirs, tmp_dir, exist_ok=True)
+		tmp_path = os.path.join(tmp_dir, f"{uuid.uuid4().hex}.part")
+		try:
+			await self.bot.download(file_id, destination=tmp_path)
+			sha256 = await asyncio.to_thread(_hash_file, tmp_path)
+			path, size = await asyncio.to_thread(_place, tmp_path, self.directory, sha256)
+		except BaseException:
+			if os.path.exists(tmp_path):
+				os.remove(tmp_path)
+			raise
+
+		async with async_session() as session:
+			try:
+				session.add(FileBlob(file_unique_id=file_unique_id, sha256=sha256, path=path, size=size))
+				await session.commit()
+			except IntegrityError:
+				# Another worker or replica recorded it first
+				await session.rollback()
+			except SQLAlchemyError as e:
+				logging.error("Failed to record file %s: %s", file_unique_id, e)
+
+	async def close(self):
+		"""Finish queued downloads, then stop the workers."""
+		if self._queue is None:
+			return
+		await self._queue.join()
+		for task in self._worker_tasks:
+			task.cancel()
+		await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+		self._queue = None
+		self._worker_tasks = []
@@ -0,0 +1,158 @@
+# fsm_storage.py
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SQLAlchemyError
+
+from config import FSM_STATE_TTL, FSM_FLUSH_INTERVAL, FSM_MAX_PENDING
+from model import FSMRecord
+
+_UNSET = object()
+
+
+class SQLStorage(BaseStorage):
+	"""FSM storage kept in the bot database, shared by all workers.
+
+	State changes are written through at once, together with any buffered data
+	of the same key, so whichever worker receives the user's next update routes
+	it by the current state. Data-only writes are buffered per key and flushed
+	in batches every ``flush_interval`` seconds (or once ``max_pending`` keys are
+	dirty), so a burst of ``state.update_data`` calls costs one upsert instead
+	of one round-trip each. Until that flush other workers read the previous
+	data: run several workers with user-sticky routing, or set
+	``flush_interval`` to 0 to write everything through.
+	Records not touched for ``ttl`` seconds are treated as abandoned and purged.
+	"""
+
+	def __init__(
+			self,
+			session_factory,
+			ttl: int = FSM_STATE_TTL,
+			flush_interval: float = FSM_FLUSH_INTERVAL,
+			max_pending: int = FSM_MAX_PENDING,
+	):
+		self.session_factory = session_factory
+		self.ttl = timedelta(seconds=ttl)
+		self.flush_interval = flush_interval
+		self.max_pending = max_pending
+		self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+		# key -> {"state": ..., "data": ...}; only the fields that were written
+		self._pending: Dict[str, Dict[str, Any]] = {}
+		self._flushing: Dict[str, Dict[str, Any]] = {}
+		self._flush_lock = asyncio.Lock()
+		self._flush_task: Optional[asyncio.Task] = None
+		self._last_purge = datetime.utcnow()
+
+	def _pending_value(self, key: str, field: str):
+		for buffer in (self._pending, self._flushing):
+			record = buffer.get(key)
+			if record is not None and field in record:
+				return record[field]
+		return _UNSET
+
+	async def _load(self, key: str) -> Optional[FSMRecord]:
+		async with self.session_factory() as session:
+			result = await session.execute(
+				select(FSMRecord).where(FSMRecord.key == key, FSMRecord.expires_at > datetime.utcnow())
+			)
+			return result.scalar_one_or_none()
+
+	async def _write(self, key: str, write_through: bool = False, **fields):
+		self._pending.setdefault(key, {}).update(fields)
+		if write_through or self.flush_interval <= 0 or len(self._pending) >= self.max_pending:
+			await self.flush()
+		elif self._flush_task is None or self._flush_task.done():
+			self._flush_task = asyncio.create_task(self._flush_later())
+
+	async def _flush_later(self):
+		await asyncio.sleep(self.flush_interval)
+		# Cancelling the timer must not interrupt a flush that has started
+		await asyncio.shield(self.flush())
+
+	def _insert(self, dialect: str):
+		if dialect == "postgresql":
+			return postgresql.insert(FSMRecord)
+		if dialect == "sqlite":
+			return sqlite.insert(FSMRecord)
+		raise NotImplementedError(f"SQLStorage does not support the {dialect} dialect")
+
+	async def flush(self):
+		"""Write all buffered changes to the database."""
+		async with self._flush_lock:
+			if not self._pending:
+				return
+			self._flushing, self._pending = self._pending, {}
+			expires_at = datetime.utcnow() + self.ttl
+
+			# Group rows by the set of columns written so each group is one executemany
+			groups: Dict[tuple, list] = {}
+			for key, fields in self._flushing.items():
+				columns = tuple(sorted(fields))
+				groups.setdefault(columns, []).append({"key": key, "expires_at": expires_at, **fields})
+
+			try:
+				async with self.session_factory() as session:
+					dialect = session.bind.dialect.name
+					for columns, rows in groups.items():
+						stmt = self._insert(dialect)
+						stmt = stmt.on_conflict_do_update(
+							index_elements=[FSMRecord.key],
+							set_={column: stmt.excluded[column] for column in (*columns, "expires_at")},
+						)
+						await session.execute(stmt, rows)
+					await self._purge_expired(session)
+					await session.commit()
+			except SQLAlchemyError as e:
+				logging.error("Failed to flush FSM states: %s", e)
+				# Put the changes back unless newer writes superseded them
+				for key, fields in self._flushing.items():
+					self._pending[key] = {**fields, **self._pending.get(key, {})}
+			finally:
+				self._flushing = {}
+
+	async def _purge_expired(self, session):
+		now = datetime.utcnow()
+		if now - self._last_purge < timedelta(minutes=5):
+			return
+		self._last_purge = now
+		await session.execute(delete(FSMRecord).where(FSMRecord.expires_at <= now))
+
+	async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+		await self._write(
+			self.key_builder.build(key),
+			write_through=True,
+			state=state.state if isinstance(state, State) else state,
+		)
+
+	async def get_state(self, key: StorageKey) -> Optional[str]:
+		built_key = self.key_builder.build(key)
+		state = self._pending_value(built_key, "state")
+		if state is not _UNSET:
+			return state
+		record = await self._load(built_key)
+		return record.state if record else None
+
+	async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+		await self._write(self.key_builder.build(key), data=data.copy())
+
+	async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+		built_key = self.key_builder.build(key)
+		data = self._pending_value(built_key, "data")
+		if data is not _UNSET:
+			return data.copy()
+		record = await self._load(built_key)
+		return dict(record.data) if record and record.data else {}
+
+	async def close(self) -> None:
+		if self._flush_task is not None:
+			self._flush_task.cancel()
+			await asyncio.gather(self._flush_task, return_exceptions=True)
+		# Waits for a flush in progress, then writes the rest
+		await self.flush()
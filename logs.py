@@ -0,0 +1,67 @@
+# logs.py
+"""Logging setup: records are queued by the caller and written by a listener thread.
+
+Every record carries the ``correlation_id`` of the update being processed
+(set by :class:`middlewares.CorrelationIdMiddleware`), so all lines written
+while handling one update can be grouped together.
+"""
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from config import LOG_LEVEL, LOG_FORMAT
+
+correlation_id: ContextVar[str] = ContextVar("correlation_id", default="-")
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(correlation_id)s] %(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+	"""One JSON object per line."""
+
+	def format(self, record: logging.LogRecord) -> str:
+		entry = {
+			"ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+			"level": record.levelname,
+			"logger": record.name,
+			"message": record.getMessage(),
+			"correlation_id": getattr(record, "correlation_id", "-"),
+		}
+		if record.exc_text:
+			entry["exc_info"] = record.exc_text
+		return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+	def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+		# Runs in the caller: capture the context-bound id and render the message
+		# and traceback here, so the listener thread only formats plain strings
+		record = copy.copy(record)
+		record.correlation_id = correlation_id.get()
+		record.message = record.getMessage()
+		if record.exc_info and not record.exc_text:
+			record.exc_text = _formatter.formatException(record.exc_info)
+		record.msg, record.args, record.exc_info = record.message, None, None
+		return record
+
+
+_formatter = logging.Formatter()
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> logging.handlers.QueueListener:
+	"""Route the root logger through a queue; the returned listener must be stopped on exit."""
+	stream = logging.StreamHandler()
+	stream.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+	log_queue = queue.SimpleQueue()
+	root = logging.getLogger()
+	root.handlers[:] = [_QueueHandler(log_queue)]
+	root.setLevel(level.upper())
+
+	listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+	listener.start()
+	return listener
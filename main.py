@@ -1,74 +1,121 @@
 # main.py
 import asyncio
+import csv
+import io
+import re
+import os
+import secrets
+import tempfile
+from typing import Union
 from datetime import datetime, timedelta
 from aiogram import Bot, Dispatcher, types, Router, F
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ContentType, ReplyKeyboardRemove
 from sqlalchemy.future import select
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import insert, update
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from config import TELEGRAM_TOKEN
-from database import engine, Base, async_session
-from model import Student, Homework, Submission, Teacher
+from config import (
+	TELEGRAM_TOKEN, RUN_MODE, FSM_STORAGE, METRICS_HOST, METRICS_PORT, ROSTER_MAX_FILE_SIZE, GRADES_MAX_FILE_SIZE,
+)
+from database import engine, async_session, check_connection
+from model import Student, Homework, Teacher, SubmissionFile, Group, GroupMember
+from fsm_storage import SQLStorage
+from migrations import migrate
+import repository
+import points
+import roster
+import metrics
+from sender import Sender
+from file_store import FileStore
+from scheduler import Scheduler
+from aiogram.methods import SendDocument, SendMessage
+from callbacks import (
+	SelectSubmission, GradeSubmission, DownloadSubmission, ReviewPage, MissingPage, HomeworkGroup, SubmitHomework,
+)
+from cache import role_cache, group_cache, active_homeworks, get_student_groups
+from middlewares import CorrelationIdMiddleware, DbSessionMiddleware, RoleMiddleware
+from logs import setup_logging
+from media_groups import MediaGroupBuffer
+from ordering import OrderedUpdateMiddleware
+from throttling import ThrottlingMiddleware
 
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.storage.memory import MemoryStorage
-import json
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-import os
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
 import logging
 
-logging.basicConfig(level=logging.INFO)
-
 # FSM Configuration
-storage = MemoryStorage()
+storage = SQLStorage(async_session) if FSM_STORAGE == "sql" else MemoryStorage()
 
 
-async def process_download(callback_query: types.CallbackQuery, submission_id: int):
+async def process_download(callback_query: types.CallbackQuery, submission_id: int, session: AsyncSession, teacher: Teacher):
 	"""Процесс скачивания файла по его ID."""
-	async with async_session() as session:
-		try:
-			# Получаем файл из базы данных
-			submission_query = await session.execute(
-				select(Submission).where(Submission.id == submission_id)
-			)
-			submission = submission_query.scalar_one_or_none()
+	try:
+		# Получаем файл из базы данных; только решения к заданиям этого учителя
+		submission = await repository.get_submission(session, submission_id, teacher_id=teacher.id)
 
-			if not submission:
-				await callback_query.message.answer("Файл не найден.")
-				await callback_query.answer("Ошибка!")
-				return
+		if not submission:
+			await callback_query.message.answer("Файл не найден.")
+			await callback_query.answer("Ошибка!")
+			return
 
-			# Отправляем файл через Telegram
-			await bot.send_document(
-				chat_id=callback_query.from_user.id,
-				document=submission.file_id,
-				caption=f"Файл: {submission.file_name}"
-			)
-			await callback_query.answer("Файл отправлен!")
+		# Отправляем файлы через Telegram
+		await sender.send_documents(
+			callback_query.from_user.id,
+			submission.file_ids,
+			caption=f"Файлы: {', '.join(submission.file_names)}"
+		)
+		await callback_query.answer("Файл отправлен!")
 
-		except SQLAlchemyError as e:
-			logging.error(f"Ошибка при скачивании файла: {e}")
-			await callback_query.message.answer("Ошибка при обработке запроса. Попробуйте позже.")
-			await callback_query.answer("Ошибка!")
+	except SQLAlchemyError as e:
+		logging.error("Ошибка при скачивании файла: %s", e)
+		await callback_query.message.answer("Ошибка при обработке запроса. Попробуйте позже.")
+		await callback_query.answer("Ошибка!")
 
 
 # FSM States
 class HomeworkCreation(StatesGroup):
+	waiting_for_group = State()
 	waiting_for_description = State()
 	waiting_for_deadline = State()
 
 
+class BulkGrading(StatesGroup):
+	waiting_for_grades = State()
+
+
+class RosterImport(StatesGroup):
+	waiting_for_file = State()
+
+
 bot = Bot(token=TELEGRAM_TOKEN)
+sender = Sender(bot)
+file_store = FileStore(bot)
+scheduler = Scheduler(sender)
 dp = Dispatcher(storage=storage)
+# Runs after the dispatcher's FSM middleware; everything below runs on the per-user queue workers
+update_queue = OrderedUpdateMiddleware()
+dp.update.outer_middleware(update_queue)
+dp.update.outer_middleware(CorrelationIdMiddleware())
 router = Router()
+metrics.setup(dp, (router,), bot=bot, engine=engine)
+throttling = ThrottlingMiddleware()
+router.message.middleware(throttling)
+router.callback_query.middleware(throttling)
+router.message.middleware(DbSessionMiddleware())
+router.callback_query.middleware(DbSessionMiddleware())
+router.message.middleware(RoleMiddleware())
+router.callback_query.middleware(RoleMiddleware())
 
 # Keyboards
 teacher_menu = ReplyKeyboardMarkup(
 	keyboard=[
 		[KeyboardButton(text="Создать домашнее задание")],
 		[KeyboardButton(text="Проверить домашки")],
+		[KeyboardButton(text="Массовая оценка")],
 		[KeyboardButton(text="Посмотреть домашнее задание")]
 	],
 	resize_keyboard=True,
@@ -91,15 +138,10 @@ request_phone_menu = ReplyKeyboardMarkup(
 
 
 async def create_tables():
-	"""Create tables in the database."""
+	"""Create tables in the database and apply pending migrations."""
 	async with engine.begin() as conn:
-		await conn.run_sync(Base.metadata.create_all)
-
-
-import logging
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+		# migrate creates the tables too, under the lock that serialises replica startups
+		await conn.run_sync(migrate)
 
 
 class Registration(StatesGroup):
@@ -108,34 +150,26 @@ class Registration(StatesGroup):
 
 
 @router.message(Command("start"))
-async def start_command(message: types.Message, state: FSMContext):
+async def start_command(message: types.Message, state: FSMContext, teacher: Teacher = None, student: Student = None):
 	"""Handle /start command and initiate registration if not registered."""
-	async with async_session() as session:
-		try:
-			teacher_query = await session.execute(
-				select(Teacher).where(Teacher.telegram_id == str(message.from_user.id))
-			)
-			teacher = teacher_query.scalar_one_or_none()
-
-			if teacher:
-				await message.answer("Добро пожаловать, учитель!", reply_markup=teacher_menu)
-				return
+	if teacher:
+		await message.answer("Добро пожаловать, учитель!", reply_markup=teacher_menu)
+		return
 
-			student_query = await session.execute(
-				select(Student).where(Student.telegram_id == str(message.from_user.id))
-			)
-			student = student_query.scalar_one_or_none()
+	if student:
+		await message.answer("Привет! Вы можете посмотреть или сдать домашнее задание.",
+							 reply_markup=student_menu)
+	else:
+		await message.answer("Пожалуйста, отправьте ваш номер телефона.", reply_markup=request_phone_menu)
+		await state.set_state(Registration.waiting_for_phone)
 
-			if student:
-				await message.answer("Привет! Вы можете посмотреть или сдать домашнее задание.",
-									 reply_markup=student_menu)
-			else:
-				await message.answer("Пожалуйста, отправьте ваш номер телефона.", reply_markup=request_phone_menu)
-				await state.set_state(Registration.waiting_for_phone)
 
-		except SQLAlchemyError as e:
-			logging.error(f"Database error: {e}")
-			await message.answer("Ошибка базы данных. Попробуйте позже.")
+@router.message(Command("cancel"))
+async def cancel(message: types.Message, state: FSMContext, teacher: Teacher = None, student: Student = None):
+	"""Выход из любого незавершенного диалога."""
+	await state.clear()
+	menu = teacher_menu if teacher else student_menu if student else ReplyKeyboardRemove()
+	await message.answer("Действие отменено.", reply_markup=menu)
 
 
 @router.message(Registration.waiting_for_phone)
@@ -151,82 +185,102 @@ async def handle_phone_number(message: types.Message, state: FSMContext):
 
 
 @router.message(Registration.waiting_for_name)
-async def handle_full_name(message: types.Message, state: FSMContext):
+async def handle_full_name(message: types.Message, state: FSMContext, session: AsyncSession):
 	"""Handle full name and complete registration."""
-	async with async_session() as session:
-		try:
-			user_data = await state.get_data()
-			phone_number = user_data.get("phone_number")
-			full_name = message.text.strip()
-			first_name, last_name = full_name.split(' ', 1) if ' ' in full_name else (full_name, '')
-
-			new_student = Student(
-				telegram_id=str(message.from_user.id),
-				phone_number=phone_number,
-				first_name=first_name,
-				last_name=last_name,
-				username=message.from_user.username,
-			)
-			session.add(new_student)
-			await session.commit()
+	try:
+		user_data = await state.get_data()
+		phone_number = user_data.get("phone_number")
+		full_name = message.text.strip()
+		first_name, last_name = full_name.split(' ', 1) if ' ' in full_name else (full_name, '')
+
+		new_student = Student(
+			telegram_id=str(message.from_user.id),
+			phone_number=phone_number,
+			first_name=first_name,
+			last_name=last_name,
+			username=message.from_user.username,
+		)
+		session.add(new_student)
+		await session.commit()
+		role_cache.invalidate(str(message.from_user.id))
+
+		await message.answer(
+			"Регистрация завершена! Чтобы получать домашние задания, вступите в группу: "
+			"попросите у учителя код и отправьте /join КОД.",
+			reply_markup=student_menu,
+		)
+		await state.clear()
 
-			await message.answer("Регистрация завершена! Вы можете посмотреть или сдать домашнее задание.",
-								 reply_markup=student_menu)
-			await state.clear()
-
-		except SQLAlchemyError as e:
-			await message.answer("Ошибка базы данных. Попробуйте позже.")
-			logging.error(f"Database error: {e}")
+	except SQLAlchemyError as e:
+		await message.answer("Ошибка базы данных. Попробуйте позже.")
+		logging.error("Database error: %s", e)
 
 
 @router.message(F.text == "Создать домашнее задание")
-async def create_homework(message: types.Message, state: FSMContext):
+async def create_homework(message: types.Message, state: FSMContext, session: AsyncSession, teacher: Teacher = None):
 	"""Учитель создает домашнее задание."""
-	async with async_session() as session:
-		teacher_query = await session.execute(
-			select(Teacher).where(Teacher.telegram_id == str(message.from_user.id))
-		)
-		teacher = teacher_query.scalar_one_or_none()
+	if not teacher:
+		await message.answer("Вы не зарегистрированы как учитель.")
+		return
 
-		if not teacher:
-			await message.answer("Вы не зарегистрированы как учитель.")
-			return
-
-		# Деактивируем существующее активное задание
-		await session.execute(
-			select(Homework).where(Homework.teacher_id == teacher.id, Homework.active == 1)
-		)
-		active_homework_query = await session.execute(
-			select(Homework).where(Homework.teacher_id == teacher.id, Homework.active == 1)
-		)
-		active_homework = active_homework_query.scalars().first()
+	try:
+		groups = await repository.teacher_groups(session, teacher.id)
+	except SQLAlchemyError as e:
+		logging.error("Ошибка при получении групп: %s", e)
+		await message.answer("Ошибка при получении данных. Попробуйте позже.")
+		return
+
+	if len(groups) > 1:
+		keyboard = InlineKeyboardMarkup(inline_keyboard=[
+			[InlineKeyboardButton(text=group.name, callback_data=HomeworkGroup(id=group.id).pack())]
+			for group in groups
+		])
+		await message.answer("Выберите группу для домашнего задания:", reply_markup=keyboard)
+		await state.set_state(HomeworkCreation.waiting_for_group)
+		return
+
+	await state.update_data(group_id=groups[0].id if groups else None)
+	await message.answer("Введите описание домашнего задания:")
+	await state.set_state(HomeworkCreation.waiting_for_description)
+
+
+@router.callback_query(HomeworkCreation.waiting_for_group, HomeworkGroup.filter())
+async def choose_homework_group(callback_query: types.CallbackQuery, callback_data: HomeworkGroup, state: FSMContext):
+	"""Выбор группы для нового домашнего задания."""
+	await state.update_data(group_id=callback_data.id)
+	await callback_query.message.answer("Введите описание домашнего задания:")
+	await callback_query.answer()
+	await state.set_state(HomeworkCreation.waiting_for_description)
 
-		if active_homework:
-			active_homework.active = 1
-			await session.commit()
 
-		await message.answer("Введите описание домашнего задания:")
-		await state.set_state(HomeworkCreation.waiting_for_description)
+async def no_homework_text(student: Student = None):
+	"""Ответ, когда заданий нет; студенту вне групп подсказываем /join."""
+	if student and not await get_student_groups(student.id):
+		return "Вы пока не состоите ни в одной группе. Попросите у учителя код и отправьте /join КОД."
+	return "На данный момент нет активных домашних заданий."
 
 
 @router.message(F.text == "Посмотреть домашнее задание")
-async def view_homework(message: types.Message):
-	"""Просмотр единственного активного домашнего задания."""
-	async with async_session() as session:
-		try:
-			# Получаем единственное активное задание
-			homework_query = await session.execute(select(Homework).order_by(Homework.deadline))
-			homeworks = homework_query.scalars().all()
+async def view_homework(message: types.Message, session: AsyncSession, teacher: Teacher = None, student: Student = None):
+	"""Просмотр активных домашних заданий учителя или групп студента."""
+	try:
+		if teacher:
+			homeworks = await active_homeworks.for_teacher(teacher.id)
+		elif student:
+			homeworks = await active_homeworks.for_student_all(student.id)
+		else:
+			homeworks = []
+		homeworks = sorted(homeworks, key=lambda hw: hw.deadline)
 
-			homework_list = "\n".join([f"Описание: {hw.description}, Срок сдачи: {hw.deadline}" for hw in homeworks])
+		homework_list = "\n".join([f"Описание: {hw.description}, Срок сдачи: {hw.deadline}" for hw in homeworks])
 
-			if homeworks:
-				await message.answer(f"Домашние задания:\n{homework_list}")
-			else:
-				await message.answer("На данный момент нет активных домашних заданий.")
-		except SQLAlchemyError as e:
-			print(e)
-			await message.answer("Ошибка при получении данных. Попробуйте позже.")
+		if homeworks:
+			await message.answer(f"Домашние задания:\n{homework_list}")
+		else:
+			await message.answer(await no_homework_text(student))
+	except SQLAlchemyError as e:
+		logging.error("Ошибка при получении домашних заданий: %s", e)
+		await message.answer("Ошибка при получении данных. Попробуйте позже.")
 
 
 # @router.message(F.text == "Проверить домашки")
@@ -276,436 +330,864 @@ async def view_homework(message: types.Message):
 #             await message.answer("Ошибка при получении данных. Попробуйте позже.")
 
 
-# Ensure logging is configured at the beginning of your script
+def page_navigation(page, homework_id, rows, has_prev, has_next):
+	"""Prev/Next buttons carrying the keyset cursor of the neighbouring page."""
+	buttons = []
+	if rows and has_prev:
+		buttons.append(InlineKeyboardButton(
+			text="◀️ Назад",
+			callback_data=page(hw=homework_id, before=rows[0].id).pack(),
+		))
+	if rows and has_next:
+		buttons.append(InlineKeyboardButton(
+			text="Вперёд ▶️",
+			callback_data=page(hw=homework_id, after=rows[-1].id).pack(),
+		))
+	return buttons
+
+
+async def render_review_page(session, homework, after=None, before=None):
+	"""Текст и клавиатура одной страницы отправленных решений."""
+	submitted, not_submitted = await repository.submission_counts(session, homework)
+	rows, has_prev, has_next = await repository.review_page(session, homework.id, after, before)
+
+	buttons = [
+		[
+			InlineKeyboardButton(
+				text=f"{row.file_names} (от {row.first_name} {row.last_name})",
+				callback_data=SelectSubmission(id=row.id).pack(),
+			)
+		]
+		for row in rows
+	]
+	navigation = page_navigation(ReviewPage, homework.id, rows, has_prev, has_next)
+	if navigation:
+		buttons.append(navigation)
+	if not_submitted:
+		buttons.append([InlineKeyboardButton(
+			text="Не отправили решения",
+			callback_data=MissingPage(hw=homework.id).pack(),
+		)])
+
+	text = (
+		f"Студенты, отправившие решения: {submitted}\n"
+		f"Студенты, не отправившие решения: {not_submitted}\n\n"
+		+ ("Выберите файл для скачивания:" if rows else "Решений пока нет.")
+	)
+	return text, InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-# Ensure logging is configured at the beginning of your script
+async def render_missing_page(session, homework, after=None, before=None):
+	"""Текст и клавиатура одной страницы студентов, не отправивших решения."""
+	rows, has_prev, has_next = await repository.not_submitted_page(session, homework, after, before)
 
+	buttons = []
+	navigation = page_navigation(MissingPage, homework.id, rows, has_prev, has_next)
+	if navigation:
+		buttons.append(navigation)
+	buttons.append([InlineKeyboardButton(
+		text="К решениям",
+		callback_data=ReviewPage(hw=homework.id).pack(),
+	)])
 
-# Ensure logging is configured at the beginning of your script
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+	names = "\n".join(f"{row.first_name} {row.last_name}" for row in rows)
+	return f"Студенты, не отправившие решения:\n{names}", InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
 @router.message(F.text == "Проверить домашки")
-async def review_submissions(message: types.Message):
+async def review_submissions(message: types.Message, session: AsyncSession, teacher: Teacher = None):
 	"""Учитель проверяет отправленные решения."""
-	async with async_session() as session:
-		try:
-			teacher_query = await session.execute(
-				select(Teacher).where(Teacher.telegram_id == str(message.from_user.id))
-			)
-			teacher = teacher_query.scalars().unique().first()
-
-			if not teacher:
-				await message.answer("Вы не зарегистрированы как учитель.")
-				return
-
-			homework_query = await session.execute(
-				select(Homework).where(Homework.active == 1, Homework.teacher_id == teacher.id)
-			)
-			homework = homework_query.scalars().first()
-
-			if not homework:
-				await message.answer("Нет активных домашних заданий для проверки.")
-				return
+	if not teacher:
+		await message.answer("Вы не зарегистрированы как учитель.")
+		return
 
-			students_query = await session.execute(select(Student))
-			students = students_query.scalars().all()
+	try:
+		homeworks = await active_homeworks.for_teacher(teacher.id)
 
-			student_dict = {student.id: student for student in students}
+		if not homeworks:
+			await message.answer("Нет активных домашних заданий для проверки.")
+			return
 
-			submission_query = await session.execute(
-				select(Submission).where(Submission.homework_id == homework.id)
-			)
-			submissions = submission_query.scalars().all()
+		if len(homeworks) > 1:
+			keyboard = InlineKeyboardMarkup(inline_keyboard=[
+				[InlineKeyboardButton(
+					text=f"{homework.description[:40]} (до {homework.deadline:%d.%m %H:%M})",
+					callback_data=ReviewPage(hw=homework.id).pack(),
+				)]
+				for homework in homeworks
+			])
+			await message.answer("Выберите домашнее задание для проверки:", reply_markup=keyboard)
+			return
 
-			submitted_students_ids = {submission.student_id for submission in submissions}
-			submitted_students = [student for student in students if student.id in submitted_students_ids]
-			not_submitted_students = [student for student in students if student.id not in submitted_students_ids]
+		text, keyboard = await render_review_page(session, homeworks[0])
+		await message.answer(text, reply_markup=keyboard)
+		logging.info("Reviewed submissions and displayed to teacher.")
+	except SQLAlchemyError as e:
+		logging.error("Ошибка при проверке решений: %s", e)
+		await message.answer("Ошибка при получении данных. Попробуйте позже.")
+
+
+@router.callback_query(ReviewPage.filter())
+@router.callback_query(MissingPage.filter())
+async def handle_review_page(
+		callback_query: types.CallbackQuery,
+		callback_data: Union[ReviewPage, MissingPage],
+		session: AsyncSession,
+		teacher: Teacher = None,
+):
+	"""Листание страниц экрана проверки."""
+	if not teacher:
+		await callback_query.answer("Вы не зарегистрированы как учитель.")
+		return
 
-			submitted_list = "\n".join([f"{student.first_name} {student.last_name}" for student in submitted_students])
-			not_submitted_list = "\n".join(
-				[f"{student.first_name} {student.last_name}" for student in not_submitted_students]
-			)
+	try:
+		homework = await active_homeworks.get(callback_data.hw)
+		if not homework or homework.teacher_id != teacher.id:
+			await callback_query.answer("Это домашнее задание больше не активно.")
+			return
 
-			keyboard = InlineKeyboardMarkup(
-				inline_keyboard=[
-					[
-						InlineKeyboardButton(
-							text=f"{submission.file_names} (от {student_dict[submission.student_id].first_name} {student_dict[submission.student_id].last_name})",
-							callback_data=json.dumps({"action": "select_submission", "id": submission.id}),
-						)
-					]
-					for submission in submissions
-				]
-			)
+		render = render_review_page if isinstance(callback_data, ReviewPage) else render_missing_page
+		text, keyboard = await render(session, homework, callback_data.after, callback_data.before)
+		await callback_query.message.edit_text(text, reply_markup=keyboard)
+		await callback_query.answer()
+	except SQLAlchemyError as e:
+		logging.error("Ошибка при проверке решений: %s", e)
+		await callback_query.answer("Ошибка при получении данных. Попробуйте позже.")
+
+
+@router.callback_query(SelectSubmission.filter(), flags={"throttle": "download"})
+async def handle_submission_selection(
+		callback_query: types.CallbackQuery,
+		callback_data: SelectSubmission,
+		state: FSMContext,
+		session: AsyncSession,
+		teacher: Teacher = None,
+):
+	"""Обработка выбора файла для проверки."""
+	if not teacher:
+		await callback_query.answer("Вы не зарегистрированы как учитель.")
+		return
 
-			await message.answer(
-				f"Студенты, отправившие решения:\n{submitted_list}\n\nСтуденты, не отправившие решения:\n{not_submitted_list}"
-			)
-			await message.answer("Выберите файл для скачивания:", reply_markup=keyboard)
-			logging.info("Reviewed submissions and displayed to teacher.")
-		except SQLAlchemyError as e:
-			logging.error(f"Ошибка при проверке решений: {e}")
-			await message.answer("Ошибка при получении данных. Попробуйте позже.")
+	submission_id = callback_data.id
+	logging.info("Callback data: %s", callback_query.data)
 
+	try:
+		submission = await repository.get_submission(
+			session, submission_id, repository.SUBMISSION_WITH_STUDENT, teacher_id=teacher.id
+		)
 
-@router.callback_query(lambda c: json.loads(c.data).get("action") == "select_submission")
-async def handle_submission_selection(callback_query: types.CallbackQuery, state: FSMContext):
-	"""Обработка выбора файла для проверки."""
-	data = json.loads(callback_query.data)
-	submission_id = data.get("id")
-	logging.info(f"Callback data: {data}")
+		if not submission:
+			await callback_query.message.answer("Решение не найдено.")
+			await callback_query.answer()
+			return
 
-	async with async_session() as session:
-		try:
-			submission_query = await session.execute(
-				select(Submission).where(Submission.id == submission_id)
-			)
-			submission = submission_query.scalar_one_or_none()
+		# Store the selected submission ID in the state
+		await state.update_data(selected_submission_id=submission_id)
 
-			if not submission:
-				await callback_query.message.answer("Решение не найдено.")
-				await callback_query.answer()
-				return
+		# Send the files in media groups of up to 10 documents
+		await sender.send_documents(callback_query.from_user.id, submission.file_ids)
 
-			# Store the selected submission ID in the state
-			await state.update_data(selected_submission_id=submission_id)
-
-			# Send each file as a separate document
-			for file_id in submission.file_ids:
-				await bot.send_document(callback_query.from_user.id, file_id)
-
-			keyboard = InlineKeyboardMarkup(
-				inline_keyboard=[
-					[
-						InlineKeyboardButton(
-							text="Оценить",
-							callback_data=json.dumps({"action": "grade_submission"})
-						)
-					]
+		keyboard = InlineKeyboardMarkup(
+			inline_keyboard=[
+				[
+					InlineKeyboardButton(
+						text="Оценить",
+						callback_data=GradeSubmission(id=submission_id).pack()
+					)
 				]
-			)
-			await callback_query.message.answer(
-				f"Вы выбрали решение #{submission_id}. Нажмите на кнопку ниже, чтобы оценить.",
-				reply_markup=keyboard
-			)
-			await callback_query.answer()
-			logging.info(f"Selected submission #{submission_id} for review and sent documents.")
-		except SQLAlchemyError as e:
-			logging.error(f"Ошибка при обработке выбора файла: {e}")
-			await callback_query.message.answer("Ошибка при обработке выбора файла. Попробуйте позже.")
-			await callback_query.answer()
+			]
+		)
+		await callback_query.message.answer(
+			f"Вы выбрали решение #{submission_id} ({submission.student.first_name} {submission.student.last_name}). "
+			"Нажмите на кнопку ниже, чтобы оценить.",
+			reply_markup=keyboard
+		)
+		await callback_query.answer()
+		logging.info("Selected submission #%s for review and sent documents.", submission_id)
+	except SQLAlchemyError as e:
+		logging.error("Ошибка при обработке выбора файла: %s", e)
+		await callback_query.message.answer("Ошибка при обработке выбора файла. Попробуйте позже.")
+		await callback_query.answer()
+
+
+@router.callback_query(GradeSubmission.filter())
+async def prompt_for_grade(
+		callback_query: types.CallbackQuery,
+		callback_data: GradeSubmission,
+		state: FSMContext,
+		session: AsyncSession,
+		teacher: Teacher = None,
+):
+	"""Промпт для ввода оценки."""
+	if not teacher:
+		await callback_query.answer("Вы не зарегистрированы как учитель.")
+		return
 
+	submission = await repository.get_submission(
+		session, callback_data.id, repository.SUBMISSION_WITH_STUDENT, teacher_id=teacher.id
+	)
+	if not submission:
+		await callback_query.answer("Решение не найдено.")
+		return
 
-@router.callback_query(lambda c: json.loads(c.data).get("action") == "grade_submission")
-async def prompt_for_grade(callback_query: types.CallbackQuery):
-	"""Промпт для ввода оценки."""
+	await state.update_data(selected_submission_id=callback_data.id)
 	await callback_query.message.answer(
-		"Введите оценку."
+		f"Введите оценку для решения #{submission.id} ({submission.student.first_name} {submission.student.last_name})."
 	)
 	await callback_query.answer()
 	logging.info("Prompted teacher for grade input.")
 
 
 @router.message(F.text.regexp(r'^\d+$'))
-async def grade_submission(message: types.Message, state: FSMContext):
+async def grade_submission(message: types.Message, state: FSMContext, session: AsyncSession, teacher: Teacher = None):
 	"""Учитель оценивает отправленное решение и начисляет бонусные баллы."""
-	async with async_session() as session:
-		try:
-			state_data = await state.get_data()
-			submission_id = state_data.get("selected_submission_id")
-
-			if not submission_id:
-				await message.answer("Сначала выберите решение для оценки.")
-				return
+	if not teacher:
+		await message.answer("Вы не зарегистрированы как учитель.")
+		return
 
-			grade_str = message.text
-			try:
-				grade = int(grade_str)
-			except ValueError:
-				await message.answer("Оценка должна быть числом.")
-				return
+	try:
+		state_data = await state.get_data()
+		submission_id = state_data.get("selected_submission_id")
 
-			# Calculate bonus points
-			bonus_points = {
-				5: 3,
-				4: 2,
-				3: 1,
-				2: 0,
-				1: 0  # Assuming any grade lower than 2 gets 0 points
-			}.get(grade, 0)
-
-			submission_query = await session.execute(
-				select(Submission).where(Submission.id == submission_id)
-			)
-			submission = submission_query.scalar_one_or_none()
+		if not submission_id:
+			await message.answer("Сначала выберите решение для оценки.")
+			return
 
-			if not submission:
-				await message.answer("Решение не найдено.")
-				return
+		grade_str = message.text
+		try:
+			grade = int(grade_str)
+		except ValueError:
+			await message.answer("Оценка должна быть числом.")
+			return
+		if grade not in points.GRADES:
+			await message.answer(f"Оценка должна быть от {points.GRADES[0]} до {points.GRADES[-1]}.")
+			return
 
-			submission.grade = grade
-			submission.bonus_points = bonus_points
-			submission.is_reviewed = True
-			await session.commit()
+		# Grade, ledger entry and the student's total are committed together
+		bonus_points = await points.grade_submission(session, submission_id, grade, teacher_id=teacher.id)
 
-			await message.answer(
-				f"Решение #{submission_id} оценено на {grade} баллов и начислено {bonus_points} бонусных баллов.")
-			logging.info(
-				f"Submission #{submission_id} graded with {grade} points and awarded {bonus_points} bonus points.")
-		except (ValueError, SQLAlchemyError) as e:
-			logging.error(f"Ошибка при выставлении оценки: {e}")
-			await message.answer("Ошибка при выставлении оценки. Убедитесь, что команда введена корректно.")
+		if bonus_points is None:
+			await message.answer("Решение не найдено.")
+			return
 
+		await session.commit()
+
+		await message.answer(
+			f"Решение #{submission_id} оценено на {grade} баллов и начислено {bonus_points} бонусных баллов.")
+		logging.info(
+			"Submission #%s graded with %s points and awarded %s bonus points.", submission_id, grade, bonus_points)
+	except (ValueError, SQLAlchemyError) as e:
+		logging.error("Ошибка при выставлении оценки: %s", e)
+		await message.answer("Ошибка при выставлении оценки. Убедитесь, что команда введена корректно.")
+
+
+@router.message(Command("leaderboard"))
+async def show_leaderboard(
+		message: types.Message,
+		session: AsyncSession,
+		teacher: Teacher = None,
+		student: Student = None,
+):
+	"""Рейтинг студентов по бонусным баллам: учителю по его группам, студенту по его группам."""
+	if not teacher and not student:
+		await message.answer("Сначала зарегистрируйтесь: /start")
+		return
 
-@router.callback_query()
-async def handle_callback(callback_query: types.CallbackQuery):
-	"""Обработка всех callback-запросов."""
 	try:
-		# Распаковываем данные из callback_data
-		data = json.loads(callback_query.data)
+		if teacher:
+			rows = await points.leaderboard(session, teacher_id=teacher.id)
+		else:
+			memberships = await get_student_groups(student.id)
+			rows = await points.leaderboard(session, group_ids=[group_id for group_id, _ in memberships])
+
+		if not rows:
+			await message.answer("Рейтинг пока пуст.")
+			return
 
-		if data.get("action") == "download":
-			await process_download(callback_query, data["id"])
+		leaderboard = "\n".join(
+			f"{place}. {row.first_name} {row.last_name} — {row.total_points or 0}"
+			for place, row in enumerate(rows, start=1)
+		)
+		await message.answer(f"Рейтинг студентов:\n{leaderboard}")
+	except SQLAlchemyError as e:
+		logging.error("Ошибка при получении рейтинга: %s", e)
+		await message.answer("Ошибка при получении данных. Попробуйте позже.")
 
-	except (ValueError, KeyError):
-		await callback_query.answer("Ошибка обработки данных.")
 
+def decode_csv(raw: bytes) -> str:
+	"""Текст CSV-файла в UTF-8 или в cp1251, в которой его сохраняет Excel на русской Windows."""
+	try:
+		return raw.decode("utf-8-sig")
+	except UnicodeDecodeError:
+		return raw.decode("cp1251")
+
+
+GRADE_LINE = re.compile(r"^\s*#?(\d+)\s*[\s,;:]\s*(\d+)\s*$")
+
+
+def parse_grades(lines):
+	"""Разбор строк «ID оценка»; возвращает ({id: оценка}, номера ошибочных строк)."""
+	grades = {}
+	bad_lines = []
+	for number, line in enumerate(lines, start=1):
+		if not line.strip():
+			continue
+		match = GRADE_LINE.match(line)
+		if not match or int(match.group(2)) not in points.GRADES:
+			bad_lines.append(number)
+			continue
+		grades[int(match.group(1))] = int(match.group(2))
+	return grades, bad_lines
+
+
+@router.message(F.text == "Массовая оценка")
+async def start_bulk_grading(message: types.Message, state: FSMContext, teacher: Teacher = None):
+	"""Учитель оценивает несколько решений одним сообщением или CSV-файлом."""
+	if not teacher:
+		await message.answer("Вы не зарегистрированы как учитель.")
+		return
+
+	await message.answer(
+		"Отправьте оценки строками «ID оценка» (например, «12 5»), по одной на строку, "
+		f"или CSV-файл с колонками ID и оценка. Оценки от {points.GRADES[0]} до {points.GRADES[-1]}. Отмена: /cancel"
+	)
+	await state.set_state(BulkGrading.waiting_for_grades)
 
-@router.message(F.text.startswith("Скачать"))
-async def download_submission(message: types.Message):
-	"""Скачивание отправленного файла."""
-	async with async_session() as session:
+
+# Commands are left to their own handlers, so /cancel and the rest still work here
+@router.message(
+	BulkGrading.waiting_for_grades, (F.text & ~F.text.startswith("/")) | F.document, flags={"throttle": "upload"}
+)
+async def apply_bulk_grades(message: types.Message, state: FSMContext, session: AsyncSession, teacher: Teacher = None):
+	"""Применение всех оценок одной транзакцией."""
+	if not teacher:
+		await message.answer("Вы не зарегистрированы как учитель.")
+		await state.clear()
+		return
+
+	if message.document:
+		if (message.document.file_size or 0) > GRADES_MAX_FILE_SIZE:
+			await message.answer("Файл слишком большой.")
+			return
+		content = await bot.download(message.document)
 		try:
-			# Извлекаем имя файла из текста сообщения
-			file_name = message.text.replace("Скачать ", "").strip()
+			text = decode_csv(content.read())
+		except UnicodeDecodeError:
+			await message.answer("Не удалось прочитать файл. Сохраните его в кодировке UTF-8.")
+			return
+		lines = [" ".join(row[:2]) for row in csv.reader(io.StringIO(text))]
+	else:
+		lines = message.text.splitlines()
+
+	grades, bad_lines = parse_grades(lines)
+	if not grades:
+		await message.answer(
+			"Не найдено ни одной строки «ID оценка». Начните заново: «Массовая оценка».", reply_markup=teacher_menu
+		)
+		await state.clear()
+		return
 
-			# Ищем запись в базе данных
-			submission_query = await session.execute(
-				select(Submission).where(Submission.file_name == file_name)
+	try:
+		graded = await points.grade_submissions(session, grades, teacher_id=teacher.id)
+		await session.commit()
+	except SQLAlchemyError as e:
+		logging.error("Ошибка при массовой оценке: %s", e)
+		await message.answer("Ошибка при выставлении оценок. Попробуйте позже.")
+		return
+
+	report = f"Оценено решений: {len(graded)}."
+	not_found = sorted(set(grades) - set(graded))
+	if not_found:
+		report += f"\nНе найдены: {', '.join(map(str, not_found))}."
+	if bad_lines:
+		report += f"\nПропущены строки: {', '.join(map(str, bad_lines))}."
+	await message.answer(report, reply_markup=teacher_menu)
+	await state.clear()
+	logging.info("Bulk graded %s submissions.", len(graded))
+
+
+@router.message(Command("import"))
+async def start_roster_import(
+		message: types.Message,
+		command: CommandObject,
+		state: FSMContext,
+		session: AsyncSession,
+		teacher: Teacher = None,
+):
+	"""Учитель загружает список студентов CSV-файлом; /import КОД добавляет их в группу."""
+	if not teacher:
+		await message.answer("Вы не зарегистрированы как учитель.")
+		return
+
+	group_id = None
+	if command.args:
+		try:
+			group_query = await session.execute(
+				select(Group.id).where(Group.code == command.args.strip(), Group.teacher_id == teacher.id)
 			)
-			submission = submission_query.scalar_one_or_none()
+			group_id = group_query.scalar_one_or_none()
+		except SQLAlchemyError as e:
+			logging.error("Ошибка при получении групп: %s", e)
+			await message.answer("Ошибка при получении данных. Попробуйте позже.")
+			return
+		if group_id is None:
+			await message.answer("Группа с таким кодом не найдена.")
+			return
+
+	await state.update_data(group_id=group_id)
+	await message.answer(
+		"Отправьте CSV-файл со столбцами telegram_id, phone_number, first_name, last_name, username "
+		"(username можно не указывать). Уже зарегистрированные студенты будут пропущены."
+	)
+	await state.set_state(RosterImport.waiting_for_file)
 
-			if not submission:
-				await message.answer("Файл не найден.")
+
+@router.message(RosterImport.waiting_for_file, F.document, flags={"throttle": "upload"})
+async def import_roster(message: types.Message, state: FSMContext, session: AsyncSession, teacher: Teacher = None):
+	"""Добавление всех студентов из файла одной транзакцией."""
+	if not teacher:
+		await message.answer("Вы не зарегистрированы как учитель.")
+		await state.clear()
+		return
+	if (message.document.file_size or 0) > ROSTER_MAX_FILE_SIZE:
+		await message.answer("Файл слишком большой.")
+		return
+
+	content = await bot.download(message.document)
+	try:
+		records, bad_lines = roster.parse_roster(decode_csv(content.read()))
+	except UnicodeDecodeError:
+		await message.answer("Не удалось прочитать файл. Сохраните его в кодировке UTF-8.")
+		return
+	if not records:
+		await message.answer("В файле не найдено ни одного студента. Попробуйте снова.")
+		return
+
+	group_id = (await state.get_data()).get("group_id")
+	try:
+		added = await roster.import_students(session, records, group_id)
+		await session.commit()
+	except SQLAlchemyError as e:
+		logging.error("Ошибка при импорте студентов: %s", e)
+		await message.answer("Ошибка при импорте студентов. Попробуйте позже.")
+		return
+
+	# Imported users may have been cached as unregistered
+	for record in records:
+		role_cache.invalidate(record[0])
+	if group_id is not None:
+		group_cache.clear()
+
+	report = f"Добавлено студентов: {added}. Уже были зарегистрированы: {len(records) - added}."
+	if bad_lines:
+		report += f"\nПропущены строки: {', '.join(map(str, bad_lines))}."
+	await message.answer(report, reply_markup=teacher_menu)
+	await state.clear()
+	logging.info("Imported %s students from a roster of %s.", added, len(records))
+
+
+@router.message(Command("export"))
+async def export_homework(message: types.Message, command: CommandObject, session: AsyncSession, teacher: Teacher = None):
+	"""Выгрузка решений и оценок по домашнему заданию в CSV."""
+	if not teacher:
+		await message.answer("Вы не зарегистрированы как учитель.")
+		return
+
+	try:
+		if command.args and command.args.strip().isdigit():
+			homework_query = await session.execute(
+				select(Homework).where(Homework.id == int(command.args.strip()), Homework.teacher_id == teacher.id)
+			)
+			homework = homework_query.scalar_one_or_none()
+		else:
+			homeworks = await active_homeworks.for_teacher(teacher.id)
+			if len(homeworks) > 1:
+				await message.answer("Укажите номер задания: " + ", ".join(
+					f"/export {homework.id} ({homework.description[:30]})" for homework in homeworks
+				))
 				return
+			homework = homeworks[0] if homeworks else None
+	except SQLAlchemyError as e:
+		logging.error("Ошибка при выгрузке решений: %s", e)
+		await message.answer("Ошибка при получении данных. Попробуйте позже.")
+		return
+
+	if not homework:
+		await message.answer("Домашнее задание не найдено.")
+		return
+
+	# Rows go straight to a temporary file, so memory use does not grow with the homework
+	fd, path = tempfile.mkstemp(suffix=".csv")
+	try:
+		with os.fdopen(fd, "w", newline="", encoding="utf-8-sig") as file:
+			count = await roster.export_submissions(session, homework.id, file)
+		await sender.call(SendDocument(
+			chat_id=message.chat.id,
+			document=FSInputFile(path, filename=f"homework_{homework.id}.csv"),
+			caption=f"Решений: {count}",
+		))
+	except SQLAlchemyError as e:
+		logging.error("Ошибка при выгрузке решений: %s", e)
+		await message.answer("Ошибка при получении данных. Попробуйте позже.")
+	finally:
+		os.remove(path)
+
+
+@router.callback_query(DownloadSubmission.filter(), flags={"throttle": "download"})
+async def handle_download(
+		callback_query: types.CallbackQuery,
+		callback_data: DownloadSubmission,
+		session: AsyncSession,
+		teacher: Teacher = None,
+):
+	"""Скачивание файла по кнопке."""
+	if not teacher:
+		await callback_query.answer("Вы не зарегистрированы как учитель.")
+		return
+	await process_download(callback_query, callback_data.id, session, teacher)
+
+
+@router.message(F.text.startswith("Скачать"), flags={"throttle": "download"})
+async def download_submission(message: types.Message, session: AsyncSession, teacher: Teacher = None):
+	"""Скачивание отправленного файла."""
+	if not teacher:
+		await message.answer("Вы не зарегистрированы как учитель.")
+		return
 
-			# Проверяем, существует ли файл на сервере
-			try:
-				# Отправляем файл из Telegram
-				await bot.send_document(
-					chat_id=message.from_user.id,
-					document=submission.file_id,
-					caption=f"Файл: {submission.file_name}"
-				)
-				await message.answer("Файл успешно отправлен.")
-			except Exception as e:
-				logging.error(f"Ошибка при отправке файла из Telegram: {e}")
-				await message.answer("Не удалось отправить файл. Попробуйте позже.")
+	try:
+		# Извлекаем имя файла из текста сообщения
+		file_name = message.text.replace("Скачать ", "").strip()
 
-		except SQLAlchemyError as e:
-			logging.error(f"Ошибка при скачивании файла: {e}")
-			await message.answer("Ошибка при обработке запроса. Попробуйте позже.")
+		# Ищем запись в базе данных среди решений к заданиям этого учителя
+		submission = await repository.submission_by_file_name(session, file_name, teacher.id)
 
+		if not submission:
+			await message.answer("Файл не найден.")
+			return
 
-# Ensure logging is configured at the beginning of your script
+		# Проверяем, существует ли файл на сервере
+		try:
+			# Отправляем файл из Telegram
+			await sender.call(SendDocument(
+				chat_id=message.from_user.id,
+				document=submission.file_ids[submission.file_names.index(file_name)],
+				caption=f"Файл: {file_name}"
+			))
+			await message.answer("Файл успешно отправлен.")
+		except Exception as e:
+			logging.error("Ошибка при отправке файла из Telegram: %s", e)
+			await message.answer("Не удалось отправить файл. Попробуйте позже.")
+
+	except SQLAlchemyError as e:
+		logging.error("Ошибка при скачивании файла: %s", e)
+		await message.answer("Ошибка при обработке запроса. Попробуйте позже.")
+
+
+@router.message(Command("newgroup"))
+async def create_group(message: types.Message, command: CommandObject, session: AsyncSession, teacher: Teacher = None):
+	"""Учитель создает группу; студенты вступают по коду."""
+	if not teacher:
+		await message.answer("Вы не зарегистрированы как учитель.")
+		return
+	if not command.args:
+		await message.answer("Укажите название группы: /newgroup Название")
+		return
 
-# Ensure logging is configured at the beginning of your script
+	try:
+		group = Group(teacher_id=teacher.id, name=command.args.strip()[:100], code=secrets.token_hex(4))
+		session.add(group)
+		await session.commit()
+		await message.answer(f"Группа «{group.name}» создана. Код для студентов: /join {group.code}")
+	except SQLAlchemyError as e:
+		logging.error("Ошибка при создании группы: %s", e)
+		await message.answer("Ошибка при создании группы. Попробуйте позже.")
+
+
+@router.message(Command("groups"))
+async def list_groups(message: types.Message, session: AsyncSession, teacher: Teacher = None):
+	"""Список групп учителя с кодами."""
+	if not teacher:
+		await message.answer("Вы не зарегистрированы как учитель.")
+		return
 
+	try:
+		groups = await repository.teacher_groups(session, teacher.id)
+	except SQLAlchemyError as e:
+		logging.error("Ошибка при получении групп: %s", e)
+		await message.answer("Ошибка при получении данных. Попробуйте позже.")
+		return
+
+	if not groups:
+		await message.answer("У вас пока нет групп. Создайте: /newgroup Название")
+		return
+	await message.answer("Ваши группы:\n" + "\n".join(f"{group.name}: /join {group.code}" for group in groups))
+
+
+@router.message(Command("join"))
+async def join_group(message: types.Message, command: CommandObject, session: AsyncSession, student: Student = None):
+	"""Студент вступает в группу по коду."""
+	if not student:
+		await message.answer("You are not registered as a student.")
+		return
+	if not command.args:
+		await message.answer("Укажите код группы: /join КОД")
+		return
 
-@router.message(F.text == "Отправить решение")
-async def ask_for_submission(message: types.Message, state: FSMContext):
-	"""Initiate the file submission process."""
-	async with async_session() as session:
+	try:
+		group_query = await session.execute(select(Group).where(Group.code == command.args.strip()))
+		group = group_query.scalar_one_or_none()
+
+		if not group:
+			await message.answer("Группа с таким кодом не найдена.")
+			return
+
+		group_name = group.name
+		session.add(GroupMember(group_id=group.id, student_id=student.id))
 		try:
-			homework_query = await session.execute(
-				select(Homework).where(Homework.active == 1)
-			)
-			homework = homework_query.scalars().first()
-
-			if homework:
-				await state.update_data(
-					submission_in_progress=True,
-					file_ids=[],
-					file_names=[]
-				)
-				await message.answer(
-					"Отправьте файлы с решением в формате документа. Вы можете отправить несколько файлов.")
-			else:
-				await message.answer("На данный момент нет активных домашних заданий.")
-		except SQLAlchemyError as e:
-			logging.error(f"Ошибка при проверке домашнего задания: {e}")
-			await message.answer("Ошибка при проверке домашнего задания. Попробуйте позже.")
+			await session.commit()
+		except IntegrityError:
+			await message.answer(f"Вы уже состоите в группе «{group_name}».")
+			return
+		group_cache.invalidate(student.id)
+		await message.answer(f"Вы вступили в группу «{group_name}».")
+	except SQLAlchemyError as e:
+		logging.error("Ошибка при вступлении в группу: %s", e)
+		await message.answer("Ошибка базы данных. Попробуйте позже.")
+
+
+async def start_submission(message: types.Message, state: FSMContext, homework):
+	"""Begin collecting files for a submission to ``homework``."""
+	await state.update_data(
+		submission_in_progress=True,
+		homework_id=homework.id,
+		# Identifies this submission; finalizing twice with it stores one row
+		submission_token=secrets.token_hex(16),
+		file_ids=[],
+		file_names=[],
+		file_unique_ids=[]
+	)
+	await message.answer(
+		f"Задание: {homework.description}\n"
+		"Отправьте файлы с решением в формате документа. Вы можете отправить несколько файлов.")
 
 
 @router.message(F.text == "Отправить решение")
-async def ask_for_submission(message: types.Message, state: FSMContext):
-	"""Initiate the file submission process."""
-	async with async_session() as session:
-		try:
-			homework_query = await session.execute(
-				select(Homework).where(Homework.active == 1)
-			)
-			homework = homework_query.scalars().first()
-
-			if homework:
-				await state.update_data(
-					submission_in_progress=True,
-					file_ids=[],
-					file_names=[]
-				)
-				await message.answer(
-					"Отправьте файлы с решением в формате документа. Вы можете отправить несколько файлов.")
-			else:
-				await message.answer("На данный момент нет активных домашних заданий.")
-		except SQLAlchemyError as e:
-			logging.error(f"Ошибка при проверке домашнего задания: {e}")
-			await message.answer("Ошибка при проверке домашнего задания. Попробуйте позже.")
+async def ask_for_submission(message: types.Message, state: FSMContext, student: Student = None):
+	"""Initiate the file submission process; with several active homeworks the student picks one."""
+	if not student:
+		await message.answer("You are not registered as a student.")
+		return
 
+	try:
+		homeworks = await active_homeworks.for_student_all(student.id)
+
+		if len(homeworks) == 1:
+			await start_submission(message, state, homeworks[0])
+		elif homeworks:
+			keyboard = InlineKeyboardMarkup(inline_keyboard=[
+				[InlineKeyboardButton(
+					text=f"{hw.description[:40]} (до {hw.deadline:%d.%m %H:%M})",
+					callback_data=SubmitHomework(id=hw.id).pack(),
+				)]
+				for hw in homeworks
+			])
+			await message.answer("Выберите задание, к которому отправляете решение:", reply_markup=keyboard)
+		else:
+			await message.answer(await no_homework_text(student))
+	except SQLAlchemyError as e:
+		logging.error("Ошибка при проверке домашнего задания: %s", e)
+		await message.answer("Ошибка при проверке домашнего задания. Попробуйте позже.")
+
+
+@router.callback_query(SubmitHomework.filter())
+async def choose_submission_homework(
+		callback_query: types.CallbackQuery,
+		callback_data: SubmitHomework,
+		state: FSMContext,
+		student: Student = None,
+):
+	"""Выбор задания для отправки решения."""
+	if not student:
+		await callback_query.answer("You are not registered as a student.")
+		return
 
-@router.message(F.content_type == ContentType.DOCUMENT)
-async def handle_submission(message: types.Message, state: FSMContext):
-	"""Process the submitted files and save them as a single submission."""
-	async with async_session() as session:
-		try:
-			# Check if there is an active homework
-			homework_query = await session.execute(
-				select(Homework).where(Homework.active == 1)
-			)
-			homework = homework_query.scalars().first()
+	try:
+		homeworks = await active_homeworks.for_student_all(student.id)
+	except SQLAlchemyError as e:
+		logging.error("Ошибка при проверке домашнего задания: %s", e)
+		await callback_query.answer("Ошибка при проверке домашнего задания. Попробуйте позже.")
+		return
+
+	# Only homework that is still active and given to the student's groups
+	homework = next((hw for hw in homeworks if hw.id == callback_data.id), None)
+	if not homework:
+		await callback_query.answer("Это задание больше не принимает решения.")
+		return
+
+	await start_submission(callback_query.message, state, homework)
+	await callback_query.answer()
 
-			if not homework:
-				await message.answer("Currently, there are no active assignments.")
-				return
 
-			# Check if the user is registered as a student
-			student_query = await session.execute(
-				select(Student).where(Student.telegram_id == str(message.from_user.id))
+async def store_documents(messages):
+	"""Add one or more documents from the same student to the submission in progress."""
+	first = messages[0]
+	state = dp.fsm.get_context(bot, chat_id=first.chat.id, user_id=first.from_user.id)
+
+	async def reply(text):
+		await first.answer(text)
+
+	try:
+		# Get state data
+		state_data = await state.get_data()
+		submission_in_progress = state_data.get("submission_in_progress", False)
+
+		if not submission_in_progress:
+			await reply("Please start the submission process by clicking 'Отправить решение'.")
+			return
+
+		# The homework chosen when the submission was started must still be active
+		homework = await active_homeworks.get(state_data.get("homework_id"))
+
+		if not homework:
+			await reply("Currently, there are no active assignments.")
+			return
+
+		# Validate deadline
+		deadline = homework.deadline.replace(tzinfo=None) if homework.deadline.tzinfo else homework.deadline
+		current_time = datetime.now()
+		if current_time > deadline:
+			await reply(
+				f"The deadline for the assignment has passed ({deadline.strftime('%Y-%m-%d %H:%M:%S')}). You cannot submit your solution."
 			)
-			student = student_query.scalar_one_or_none()
+			return
 
-			if not student:
-				await message.answer("You are not registered as a student.")
-				return
+		# Save file details to the state, once for the whole batch
+		documents = [message.document for message in messages]
+		await state.update_data(
+			file_ids=state_data.get("file_ids", []) + [document.file_id for document in documents],
+			file_names=state_data.get("file_names", []) + [document.file_name for document in documents],
+			file_unique_ids=state_data.get("file_unique_ids", []) + [document.file_unique_id for document in documents],
+		)
 
-			# Validate deadline
-			deadline = homework.deadline.replace(tzinfo=None) if homework.deadline.tzinfo else homework.deadline
-			current_time = datetime.now()
-			if current_time > deadline:
-				await message.answer(
-					f"The deadline for the assignment has passed ({deadline.strftime('%Y-%m-%d %H:%M:%S')}). You cannot submit your solution."
-				)
-				return
+		# Download in the background; identical files are stored once
+		for document in documents:
+			file_store.submit(document.file_id, document.file_unique_id)
 
-			# Get state data
-			state_data = await state.get_data()
-			submission_in_progress = state_data.get("submission_in_progress", False)
+		names = ", ".join(f"'{document.file_name}'" for document in documents)
+		await reply(
+			f"{'Файл' if len(documents) == 1 else 'Файлы'} {names} успешно загружен{'' if len(documents) == 1 else 'ы'}. "
+			"Отправьте другие файлы или отправьте <Завершить отправку> чтоб завершить процесс."
+		)
 
-			if not submission_in_progress:
-				await message.answer("Please start the submission process by clicking 'Отправить решение'.")
-				return
+	except SQLAlchemyError as e:
+		await reply("An error occurred while saving. Please try again later.")
+		logging.error("SQLAlchemyError: %s", e)
 
-			# Save file details to the state
-			file_ids = state_data.get("file_ids", [])
-			file_names = state_data.get("file_names", [])
-			file_ids.append(message.document.file_id)
-			file_names.append(message.document.file_name)
 
-			await state.update_data(file_ids=file_ids, file_names=file_names)
+# Albums arrive as one update per file; store each album as a single batch
+document_buffer = MediaGroupBuffer(store_documents)
 
-			# Save the file locally
-			directory = 'submissions'
-			if not os.path.exists(directory):
-				os.makedirs(directory)
 
-			file_path = os.path.join(directory, f"{student.id}_{homework.id}_{message.document.file_name}")
-			await bot.download(message.document, destination=file_path)
+async def shutdown():
+	"""Stop everything in dependency order, the bot session and the database last.
 
-			await message.answer(
-				f"Файл '{message.document.file_name}' успешно загружен. Отправьте другие файлы или отправьте <Завершить отправку> чтоб завершить процесс.")
+	Queued updates may add to the album buffer, the buffer writes FSM data and
+	sends replies, and every send needs the session.
+	"""
+	await update_queue.close()
+	await document_buffer.close()
+	await dp.fsm.close()
+	await scheduler.close()
+	await sender.close()
+	await file_store.close()
+	await bot.session.close()
+	await active_homeworks.close()
+	await engine.dispose()
+
+
+# Replaces the dispatcher's own hook, which closed the storage before the updates were drained
+dp.shutdown.handlers[:] = [handler for handler in dp.shutdown.handlers if handler.callback != dp.fsm.close]
+dp.shutdown.register(shutdown)
 
-		except SQLAlchemyError as e:
-			await message.answer("An error occurred while saving. Please try again later.")
-			logging.error(f"SQLAlchemyError: {e}")
+
+@router.message(F.content_type == ContentType.DOCUMENT, flags={"throttle": "upload"})
+async def handle_submission(message: types.Message, student: Student = None):
+	"""Queue a submitted file; files of one album are stored together."""
+	if not student:
+		await message.answer("You are not registered as a student.")
+		return
+
+	await document_buffer.add(message.from_user.id, message.media_group_id, message)
 
 
 @router.message(F.text == "Завершить отправку")
-async def finalize_submission(message: types.Message, state: FSMContext):
+async def finalize_submission(message: types.Message, state: FSMContext, session: AsyncSession, student: Student = None):
 	"""Finalize the submission process and save the submission."""
-	async with async_session() as session:
-		try:
-			state_data = await state.get_data()
-			file_ids = state_data.get("file_ids", [])
-			file_names = state_data.get("file_names", [])
+	if not student:
+		await message.answer("You are not registered as a student.")
+		return
 
-			# Ensure files were uploaded
-			if not file_ids or not file_names:
-				await message.answer("Вы не загрузили ни одного файла.")
-				return
+	# Files of an album still in the buffer belong to this submission
+	await document_buffer.drain(message.from_user.id)
 
-			# Check if there is an active homework
-			homework_query = await session.execute(
-				select(Homework).where(Homework.active == 1)
-			)
-			homework = homework_query.scalars().first()
+	try:
+		state_data = await state.get_data()
+		file_ids = state_data.get("file_ids", [])
+		file_names = state_data.get("file_names", [])
+		file_unique_ids = state_data.get("file_unique_ids", [])
+
+		# Ensure files were uploaded
+		if not file_ids or not file_names:
+			await message.answer("Вы не загрузили ни одного файла.")
+			return
 
-			if not homework:
-				await message.answer("Currently, there are no active assignments.")
-				return
+		# Check the homework the submission was started for is still active
+		homework = await active_homeworks.get(state_data.get("homework_id"))
 
-			# Check if the user is registered as a student
-			student_query = await session.execute(
-				select(Student).where(Student.telegram_id == str(message.from_user.id))
-			)
-			student = student_query.scalar_one_or_none()
+		if not homework:
+			await message.answer("Currently, there are no active assignments.")
+			return
 
-			if not student:
-				await message.answer("You are not registered as a student.")
-				return
+		# Save the submission; the attempt limit is checked by the same statement
+		submission_id, created = await repository.create_submission(
+			session, homework.id, student.id,
+			state_data.get("submission_token") or secrets.token_hex(16),
+			file_ids, file_names,
+		)
 
-			# Check submission attempts
-			submission_query = await session.execute(
-				select(Submission).where(
-					Submission.student_id == student.id,
-					Submission.homework_id == homework.id
-				)
-			)
-			submission_count = len(submission_query.scalars().all())
+		if submission_id is None:
+			await message.answer("You have used all submission attempts.")
+			return
 
-			if submission_count >= homework.max_attempts:
-				await message.answer("You have used all submission attempts.")
-				return
+		if not created:
+			await message.answer("Это решение уже отправлено.")
+			await state.clear()
+			return
 
-			# Save the submission to the database
-			submission = Submission(
-				student_id=student.id,
-				homework_id=homework.id,
-				file_ids=file_ids,
-				file_names=file_names,
-				created_at=datetime.utcnow(),
-			)
-			session.add(submission)
-			await session.commit()
+		await session.execute(insert(SubmissionFile), [
+			{"submission_id": submission_id, "file_unique_id": file_unique_id, "file_name": file_name}
+			for file_unique_id, file_name in zip(file_unique_ids, file_names)
+		])
+		await session.commit()
 
-			# Notify the teacher
-			teacher_query = await session.execute(
-				select(Teacher).where(Teacher.id == homework.teacher_id)
-			)
-			teacher = teacher_query.scalar_one_or_none()
+		# Notify the teacher
+		teacher_query = await session.execute(
+			select(Teacher).where(Teacher.id == homework.teacher_id)
+		)
+		teacher = teacher_query.scalar_one_or_none()
 
-			if teacher:
-				await bot.send_message(
-					teacher.telegram_id,
-					f"Student {message.from_user.full_name} has submitted their solution for the assignment '{homework.description}'."
-				)
+		if teacher:
+			sender.submit(SendMessage(
+				chat_id=teacher.telegram_id,
+				text=f"Student {message.from_user.full_name} has submitted their solution for the assignment '{homework.description}'."
+			))
 
-			await message.answer("Ваше решение успешно отправлено и сохранено.")
-			await state.clear()
+		await message.answer("Ваше решение успешно отправлено и сохранено.")
+		await state.clear()
 
-		except SQLAlchemyError as e:
-			await message.answer("An error occurred while saving. Please try again later.")
-			logging.error(f"SQLAlchemyError: {e}")
+	except SQLAlchemyError as e:
+		await message.answer("An error occurred while saving. Please try again later.")
+		logging.error("SQLAlchemyError: %s", e)
 
 
 @router.message(HomeworkCreation.waiting_for_description)
@@ -717,56 +1199,88 @@ async def set_deadline(message: types.Message, state: FSMContext):
 
 
 @router.message(HomeworkCreation.waiting_for_deadline)
-async def save_homework(message: types.Message, state: FSMContext):
+async def save_homework(message: types.Message, state: FSMContext, session: AsyncSession, teacher: Teacher = None):
 	"""Сохранение домашнего задания."""
-	async with async_session() as session:
+	try:
 		try:
-			try:
-				deadline = datetime.strptime(message.text, "%Y-%m-%d %H:%M")
-				if deadline <= datetime.now():
-					await message.answer("Дедлайн должен быть в будущем. Попробуйте снова:")
-					return
-			except ValueError:
-				await message.answer("Некорректный формат даты. Укажите дату в формате: YYYY-MM-DD HH:MM")
+			deadline = datetime.strptime(message.text, "%Y-%m-%d %H:%M")
+			if deadline <= datetime.now():
+				await message.answer("Дедлайн должен быть в будущем. Попробуйте снова:")
 				return
+		except ValueError:
+			await message.answer("Некорректный формат даты. Укажите дату в формате: YYYY-MM-DD HH:MM")
+			return
 
-			data = await state.get_data()
-			description = data.get("description")
+		data = await state.get_data()
+		description = data.get("description")
+		group_id = data.get("group_id")
 
-			teacher_query = await session.execute(
-				select(Teacher).where(Teacher.telegram_id == str(message.from_user.id))
-			)
-			teacher = teacher_query.scalar_one_or_none()
+		if not teacher:
+			await message.answer("Вы не зарегистрированы как учитель.")
+			await state.clear()
+			return
 
-			if not teacher:
-				await message.answer("Вы не зарегистрированы как учитель.")
-				await state.clear()
-				return
+		# Деактивируем существующее активное задание группы
+		await session.execute(
+			update(Homework).where(
+				Homework.teacher_id == teacher.id,
+				Homework.group_id == group_id if group_id is not None else Homework.group_id.is_(None),
+				Homework.active == 1,
+			).values(active=0)
+		)
+		new_homework = Homework(
+			description=description,
+			deadline=deadline,
+			max_attempts=3,
+			active=1,
+			teacher_id=teacher.id,
+			group_id=group_id,
+		)
+		session.add(new_homework)
+		await session.flush()
+		jobs = scheduler.jobs_for(new_homework)
+		session.add_all(jobs)
+		await active_homeworks.notify(session)
+		await session.commit()
+		await active_homeworks.refresh()
+		scheduler.push(jobs)
 
-			new_homework = Homework(
-				description=description,
-				deadline=deadline,
-				max_attempts=3,
-				active=1,
-				teacher_id=teacher.id
-			)
-			session.add(new_homework)
-			await session.commit()
+		await message.answer("Домашнее задание успешно создано!", reply_markup=teacher_menu)
+		await state.clear()
 
-			await message.answer("Домашнее задание успешно создано!", reply_markup=teacher_menu)
-			await state.clear()
+	except SQLAlchemyError:
+		await message.answer("Ошибка при создании задания. Попробуйте позже.")
+		await state.clear()
 
-		except SQLAlchemyError:
-			await message.answer("Ошибка при создании задания. Попробуйте позже.")
-			await state.clear()
+
+# Registered last: only presses no other handler took reach it
+@router.callback_query()
+async def handle_callback(callback_query: types.CallbackQuery):
+	"""Кнопки с неизвестными или устаревшими данными."""
+	await callback_query.answer("Ошибка обработки данных.")
 
 
 async def main():
 	"""Run the bot."""
+	await check_connection()
 	await create_tables()
+	await active_homeworks.listen(engine)
+	await scheduler.start()
+	if METRICS_PORT:
+		metrics_runner = await metrics.serve(METRICS_HOST, METRICS_PORT)
+		dp.shutdown.register(metrics_runner.cleanup)
 	dp.include_router(router)
-	await dp.start_polling(bot)
+	if RUN_MODE == "webhook":
+		from webhook import run_webhook
+		await run_webhook(dp, bot)
+	else:
+		# Enqueueing is quick, and waits only when the queues are full
+		await dp.start_polling(bot, handle_as_tasks=False)
 
 
 if __name__ == "__main__":
-	asyncio.run(main())
+	log_listener = setup_logging()
+	try:
+		asyncio.run(main())
+	finally:
+		log_listener.stop()
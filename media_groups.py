@@ -0,0 +1,116 @@
+# media_groups.py
+"""Coalesce album updates into one batch per user.
+
+Telegram delivers a multi-file selection as separate updates sharing a
+``media_group_id``. :class:`MediaGroupBuffer` collects them for ``window``
+seconds and hands the whole album to ``process`` once, in the background, so
+the handler returns immediately. Batches of the same user never run
+concurrently, which keeps read-modify-write of their FSM state race-free.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import MEDIA_GROUP_WINDOW
+
+
+class KeyedLocks:
+	"""One asyncio.Lock per key, dropped once nobody holds or waits for it."""
+
+	def __init__(self):
+		self._locks: Dict[Any, list] = {}
+
+	def lock(self, key):
+		return _KeyedLock(self, key)
+
+
+class _KeyedLock:
+	__slots__ = ("owner", "key")
+
+	def __init__(self, owner: KeyedLocks, key):
+		self.owner = owner
+		self.key = key
+
+	async def __aenter__(self):
+		entry = self.owner._locks.get(self.key)
+		if entry is None:
+			entry = self.owner._locks[self.key] = [asyncio.Lock(), 0]
+		entry[1] += 1
+		try:
+			await entry[0].acquire()
+		except BaseException:
+			self._release_ref(entry)
+			raise
+
+	async def __aexit__(self, *exc):
+		entry = self.owner._locks[self.key]
+		entry[0].release()
+		self._release_ref(entry)
+
+	def _release_ref(self, entry):
+		entry[1] -= 1
+		if entry[1] == 0:
+			del self.owner._locks[self.key]
+
+
+class MediaGroupBuffer:
+	"""Buffer items per (user, media group) and process each group as one batch.
+
+	``process(items)`` receives the buffered items in arrival order. Items
+	without a media group are processed right away (still serialized per user).
+	"""
+
+	def __init__(self, process: Callable[[List[Any]], Awaitable[None]], window: float = MEDIA_GROUP_WINDOW):
+		self.process = process
+		self.window = window
+		self.locks = KeyedLocks()
+		self._groups: Dict[Tuple[int, str], List[Any]] = {}
+		self._timers: Dict[Tuple[int, str], asyncio.Task] = {}
+
+	async def add(self, user_id: int, media_group_id: Optional[str], item: Any):
+		if media_group_id is None:
+			# Keep arrival order: albums that came before this item go first
+			await self._flush_user(user_id)
+			await self._run(user_id, [item])
+			return
+
+		key = (user_id, media_group_id)
+		self._groups.setdefault(key, []).append(item)
+		if key not in self._timers:
+			self._timers[key] = asyncio.create_task(self._flush_later(key))
+
+	async def _flush_later(self, key):
+		await asyncio.sleep(self.window)
+		await self._flush(key)
+
+	async def _flush(self, key):
+		self._timers.pop(key, None)
+		items = self._groups.pop(key, None)
+		if items:
+			await self._run(key[0], items)
+
+	async def _run(self, user_id, items):
+		async with self.locks.lock(user_id):
+			try:
+				await self.process(items)
+			except Exception:
+				logging.exception("Failed to process a batch of %d updates from user %s", len(items), user_id)
+
+	async def _flush_user(self, user_id):
+		for key in [key for key in self._groups if key[0] == user_id]:
+			if key not in self._groups:
+				continue
+			# Still buffered, so its timer is asleep and safe to cancel
+			self._timers[key].cancel()
+			await self._flush(key)
+
+	async def drain(self, user_id: int):
+		"""Process the user's buffered groups now; call before reading what they produce."""
+		await self._flush_user(user_id)
+		# Wait for a batch of this user that is already running
+		async with self.locks.lock(user_id):
+			pass
+
+	async def close(self):
+		for user_id in {key[0] for key in self._groups}:
+			await self._flush_user(user_id)
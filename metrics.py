@@ -0,0 +1,245 @@
+# metrics.py
+"""In-process counters and histograms exposed in the Prometheus text format.
+
+Handlers, database queries and Telegram API calls are instrumented here;
+``GET /metrics`` renders everything recorded by this worker.
+"""
+import bisect
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import TelegramObject
+from aiohttp import web
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+	pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+	if extra:
+		pairs.append(extra)
+	return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+	return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+	"""A named metric with one value per label combination."""
+
+	kind = "untyped"
+
+	def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+		self.name = name
+		self.documentation = documentation
+		self.labels = tuple(labels)
+		self._values: Dict[Tuple[str, ...], Any] = {}
+		registry.append(self)
+
+	def render(self):
+		yield f"# HELP {self.name} {self.documentation}"
+		yield f"# TYPE {self.name} {self.kind}"
+		for label_values, value in sorted(self._values.items()):
+			yield from self._render_value(label_values, value)
+
+	def _render_value(self, label_values, value):
+		yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+	def clear(self):
+		self._values.clear()
+
+
+class Counter(Metric):
+	"""A monotonically increasing count."""
+
+	kind = "counter"
+
+	def inc(self, *label_values: str, amount: float = 1):
+		self._values[label_values] = self._values.get(label_values, 0) + amount
+
+	def value(self, *label_values: str) -> float:
+		return self._values.get(label_values, 0)
+
+
+class Gauge(Metric):
+	"""A value that can go up and down."""
+
+	kind = "gauge"
+
+	def set(self, value: float, *label_values: str):
+		self._values[label_values] = value
+
+	def inc(self, *label_values: str, amount: float = 1):
+		self._values[label_values] = self._values.get(label_values, 0) + amount
+
+	def dec(self, *label_values: str, amount: float = 1):
+		self.inc(*label_values, amount=-amount)
+
+	def value(self, *label_values: str) -> float:
+		return self._values.get(label_values, 0)
+
+
+class Histogram(Metric):
+	"""Observations counted into cumulative ``le`` buckets, with their sum and count."""
+
+	kind = "histogram"
+
+	def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+		super().__init__(name, documentation, labels)
+		self.buckets = tuple(sorted(buckets))
+
+	def observe(self, value: float, *label_values: str):
+		series = self._values.get(label_values)
+		if series is None:
+			# Per-bucket counts (last slot is +Inf), sum, count
+			series = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+		series[0][bisect.bisect_left(self.buckets, value)] += 1
+		series[1] += value
+		series[2] += 1
+
+	def count(self, *label_values: str) -> int:
+		series = self._values.get(label_values)
+		return series[2] if series else 0
+
+	def _render_value(self, label_values, series):
+		counts, total, count = series
+		cumulative = 0
+		for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+			cumulative += bucket_count
+			le = 'le="%s"' % (bound if bound == "+Inf" else _format_value(bound))
+			yield f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}"
+		yield f"{self.name}_sum{_format_labels(self.labels, label_values)} {_format_value(total)}"
+		yield f"{self.name}_count{_format_labels(self.labels, label_values)} {count}"
+
+
+registry = []
+
+updates_total = Counter("bot_updates_total", "Updates processed, by event type.", ("event",))
+update_errors_total = Counter("bot_update_errors_total", "Updates whose processing raised, by event type.", ("event",))
+update_seconds = Histogram("bot_update_seconds", "Time spent processing an update, by event type.", ("event",))
+handler_seconds = Histogram("bot_handler_seconds", "Time spent in a handler, by handler name.", ("handler",))
+db_queries_total = Counter("bot_db_queries_total", "SQL statements executed, by statement type.", ("statement",))
+db_query_seconds = Histogram("bot_db_query_seconds", "SQL statement execution time, by statement type.", ("statement",))
+telegram_requests_total = Counter("bot_telegram_requests_total", "Telegram Bot API calls, by method.", ("method",))
+telegram_request_seconds = Histogram("bot_telegram_request_seconds", "Telegram Bot API call latency, by method.", ("method",))
+telegram_flood_total = Counter("bot_telegram_429_total", "Telegram Bot API calls rejected with 429, by method.", ("method",))
+
+
+def render() -> str:
+	"""All metrics in the Prometheus text exposition format."""
+	lines = []
+	for metric in registry:
+		lines.extend(metric.render())
+	return "\n".join(lines) + "\n"
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+	"""Outer ``dp.update`` middleware timing whole updates."""
+
+	async def __call__(
+			self,
+			handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+			event: TelegramObject,
+			data: Dict[str, Any],
+	) -> Any:
+		event_type = getattr(event, "event_type", type(event).__name__)
+		started = time.perf_counter()
+		try:
+			return await handler(event, data)
+		except Exception:
+			update_errors_total.inc(event_type)
+			raise
+		finally:
+			updates_total.inc(event_type)
+			update_seconds.observe(time.perf_counter() - started, event_type)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+	"""Inner middleware timing the handler that matched the event."""
+
+	async def __call__(
+			self,
+			handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+			event: TelegramObject,
+			data: Dict[str, Any],
+	) -> Any:
+		handler_object = data.get("handler")
+		name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+		started = time.perf_counter()
+		try:
+			return await handler(event, data)
+		finally:
+			handler_seconds.observe(time.perf_counter() - started, name)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+	"""``bot.session`` middleware timing Bot API calls and counting 429 responses."""
+
+	async def __call__(self, make_request, bot, method):
+		name = type(method).__name__
+		started = time.perf_counter()
+		try:
+			return await make_request(bot, method)
+		except TelegramRetryAfter:
+			telegram_flood_total.inc(name)
+			raise
+		finally:
+			telegram_requests_total.inc(name)
+			telegram_request_seconds.observe(time.perf_counter() - started, name)
+
+
+def _statement_type(statement: str) -> str:
+	return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+	context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+	started = getattr(context, "_query_started", None) or time.perf_counter()
+	statement_type = _statement_type(statement)
+	db_queries_total.inc(statement_type)
+	db_query_seconds.observe(time.perf_counter() - started, statement_type)
+
+
+def instrument_engine(engine):
+	"""Count and time every statement executed through ``engine`` (sync or async)."""
+	sync_engine = getattr(engine, "sync_engine", engine)
+	if not event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+		event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+		event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def setup(dp, routers=(), bot=None, engine=None):
+	"""Install the update, handler, Telegram API and database instrumentation."""
+	dp.update.outer_middleware(UpdateMetricsMiddleware())
+	for router in routers:
+		router.message.middleware(HandlerMetricsMiddleware())
+		router.callback_query.middleware(HandlerMetricsMiddleware())
+	if bot is not None:
+		bot.session.middleware(TelegramMetricsMiddleware())
+	if engine is not None:
+		instrument_engine(engine)
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+	"""``GET /metrics``."""
+	return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def serve(host: str, port: int) -> web.AppRunner:
+	"""Serve ``/metrics`` on its own port (used in polling mode)."""
+	app = web.Application()
+	app.router.add_get("/metrics", handle_metrics)
+	runner = web.AppRunner(app)
+	await runner.setup()
+	await web.TCPSite(runner, host=host, port=port).start()
+	logging.info("Metrics available on http://%s:%s/metrics", host, port)
+	return runner
@@ -0,0 +1,58 @@
+# middlewares.py
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from cache import get_roles
+from database import async_session
+from logs import correlation_id
+
+
+class CorrelationIdMiddleware(BaseMiddleware):
+	"""Outer ``dp.update`` middleware tagging log records with the update id."""
+
+	async def __call__(
+			self,
+			handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+			event: TelegramObject,
+			data: Dict[str, Any],
+	) -> Any:
+		token = correlation_id.set(f"upd-{getattr(event, 'update_id', '-')}")
+		try:
+			return await handler(event, data)
+		finally:
+			correlation_id.reset(token)
+
+
+class DbSessionMiddleware(BaseMiddleware):
+	"""Open one database session per update and pass it to handlers as ``session``.
+
+	The session only checks out a connection on its first query, so updates
+	that never touch the database do not hold one.
+	"""
+
+	async def __call__(
+			self,
+			handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+			event: TelegramObject,
+			data: Dict[str, Any],
+	) -> Any:
+		async with async_session() as session:
+			data["session"] = session
+			return await handler(event, data)
+
+
+class RoleMiddleware(BaseMiddleware):
+	"""Inject the cached ``teacher``/``student`` of the sender into handler kwargs."""
+
+	async def __call__(
+			self,
+			handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+			event: TelegramObject,
+			data: Dict[str, Any],
+	) -> Any:
+		user = data.get("event_from_user")
+		if user is not None:
+			data["teacher"], data["student"] = await get_roles(user.id)
+		return await handler(event, data)
@@ -0,0 +1,138 @@
+# migrations.py
+import logging
+import secrets
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+
+import model
+from database import Base
+
+DEFAULT_GROUP_NAME = "Все студенты"
+
+# Applied versions are recorded here; kept out of Base so create_all never touches it
+migration_metadata = MetaData()
+schema_migrations = Table(
+	"schema_migrations",
+	migration_metadata,
+	Column("version", Integer, primary_key=True),
+	Column("description", String(200), nullable=False),
+	Column("applied_at", DateTime, nullable=False),
+)
+
+
+def create_index(conn, table, name):
+	"""Create an index declared in model.py unless it already exists."""
+	index = next(index for index in table.indexes if index.name == name)
+	index.create(conn, checkfirst=True)
+
+
+def add_column(conn, table, column_ddl):
+	"""ALTER TABLE ... ADD COLUMN unless the column is already there (e.g. made by create_all)."""
+	column_name = column_ddl.split()[0]
+	if column_name not in {column["name"] for column in inspect(conn).get_columns(table)}:
+		conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column_ddl}"))
+
+
+def _0001_lookup_indexes(conn):
+	create_index(conn, model.Homework.__table__, "ix_homeworks_teacher_id")
+	create_index(conn, model.Homework.__table__, "ix_homeworks_active_teacher_id")
+	create_index(conn, model.Submission.__table__, "ix_submissions_homework_id_student_id")
+	create_index(conn, model.Submission.__table__, "ix_submissions_student_id")
+
+
+def _0002_points(conn):
+	add_column(conn, "submissions", "bonus_points INTEGER NOT NULL DEFAULT 0")
+	conn.execute(text("UPDATE students SET total_points = 0 WHERE total_points IS NULL"))
+	create_index(conn, model.Student.__table__, "ix_students_total_points")
+
+
+def _0003_groups(conn):
+	# groups/group_members themselves are created by create_all
+	add_column(conn, "homeworks", "group_id INTEGER REFERENCES groups (id)")
+	create_index(conn, model.Homework.__table__, "ix_homeworks_active_group_id")
+
+
+def _0004_submission_guard(conn):
+	add_column(conn, "submissions", "attempt INTEGER")
+	add_column(conn, "submissions", "idempotency_key VARCHAR(64)")
+	# Number existing submissions so the unique attempt index holds for old rows
+	conn.execute(text(
+		"UPDATE submissions SET attempt = ("
+		"SELECT count(*) FROM submissions s2 WHERE s2.student_id = submissions.student_id "
+		"AND s2.homework_id = submissions.homework_id AND s2.id <= submissions.id"
+		") WHERE attempt IS NULL"
+	))
+	create_index(conn, model.Submission.__table__, "ux_submissions_attempt")
+	create_index(conn, model.Submission.__table__, "ux_submissions_idempotency_key")
+
+
+def _0005_deadline_jobs(conn):
+	# Homework already active when the scheduler was deployed has no jobs and would never close
+	from scheduler import Scheduler
+
+	jobs_table = model.ScheduledJob.__table__
+	homeworks = conn.execute(
+		select(model.Homework.id, model.Homework.deadline)
+		.where(model.Homework.active == 1)
+		.where(~select(jobs_table.c.id).where(jobs_table.c.homework_id == model.Homework.id).exists())
+	).all()
+	rows = [
+		{"kind": job.kind, "homework_id": job.homework_id, "run_at": job.run_at, "done": False}
+		for homework in homeworks
+		for job in Scheduler.jobs_for(homework)
+	]
+	if rows:
+		conn.execute(jobs_table.insert(), rows)
+
+
+def _0006_submission_file_names(conn):
+	create_index(conn, model.SubmissionFile.__table__, "ix_submission_files_file_name")
+
+
+def _0007_default_groups(conn):
+	# Before groups every student saw every teacher's homework. Students still in no group
+	# join a default group per teacher, so they keep seeing it after the upgrade.
+	groups, members = model.Group.__table__, model.GroupMember.__table__
+	students = model.Student.__table__
+	ungrouped = conn.execute(
+		select(students.c.id).where(~select(members.c.student_id).where(members.c.student_id == students.c.id).exists())
+	).scalars().all()
+	if not ungrouped:
+		return
+	for teacher_id in conn.execute(select(model.Teacher.__table__.c.id)).scalars().all():
+		group_id = conn.execute(
+			groups.insert().values(teacher_id=teacher_id, name=DEFAULT_GROUP_NAME, code=secrets.token_hex(4))
+		).inserted_primary_key[0]
+		conn.execute(members.insert(), [{"group_id": group_id, "student_id": student_id} for student_id in ungrouped])
+
+
+# (version, description, upgrade(conn)); append only, never edit an applied entry
+MIGRATIONS = [
+	(1, "Indexes for homework and submission lookups", _0001_lookup_indexes),
+	(2, "Submission bonus points and leaderboard index", _0002_points),
+	(3, "Homework scoped to student groups", _0003_groups),
+	(4, "Submission attempt numbers and idempotency keys", _0004_submission_guard),
+	(5, "Deadline jobs for homework created before the scheduler", _0005_deadline_jobs),
+	(6, "Index for downloads by file name", _0006_submission_file_names),
+	(7, "Default groups for students registered before groups", _0007_default_groups),
+]
+
+
+def migrate(conn):
+	"""Create missing tables and apply pending migrations on a sync connection (use via ``conn.run_sync``)."""
+	if conn.dialect.name == "postgresql":
+		# Serialise replicas starting at the same time, table creation included; released at commit
+		conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))"))
+	Base.metadata.create_all(conn)
+	migration_metadata.create_all(conn)
+
+	applied = set(conn.execute(select(schema_migrations.c.version)).scalars())
+	for version, description, upgrade in MIGRATIONS:
+		if version in applied:
+			continue
+		logging.info("Applying migration %04d: %s", version, description)
+		upgrade(conn)
+		conn.execute(
+			schema_migrations.insert().values(version=version, description=description, applied_at=datetime.utcnow())
+		)
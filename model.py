@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, JSON
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, JSON, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -13,6 +13,23 @@ class Teacher(Base):
 	name = Column(String(100), nullable=False)
 
 
+class Group(Base):
+	"""A class of students taught by one teacher; students join with ``code``."""
+	__tablename__ = "groups"
+
+	id = Column(Integer, primary_key=True, autoincrement=True)
+	teacher_id = Column(Integer, ForeignKey("teachers.id"), nullable=False, index=True)
+	name = Column(String(100), nullable=False)
+	code = Column(String(16), unique=True, nullable=False)
+
+
+class GroupMember(Base):
+	__tablename__ = "group_members"
+
+	group_id = Column(Integer, ForeignKey("groups.id"), primary_key=True)
+	student_id = Column(Integer, ForeignKey("students.id"), primary_key=True, index=True)
+
+
 class Homework(Base):
 	__tablename__ = "homeworks"
 
@@ -22,9 +39,18 @@ class Homework(Base):
 	max_attempts = Column(Integer, default=3)
 	active = Column(Integer, default=1)
 	teacher_id = Column(Integer, ForeignKey("teachers.id"), nullable=False)
+	# NULL: given to the students of all the teacher's groups; students in no group never see it
+	group_id = Column(Integer, ForeignKey("groups.id"), nullable=True)
 
 	# Relationship: one homework can have many submissions
-	submissions = relationship("Submission", back_populates="homework")
+	submissions = relationship("Submission", back_populates="homework", lazy="raise")
+
+	__table_args__ = (
+		Index("ix_homeworks_teacher_id", "teacher_id"),
+		# Only active homework is looked up by teacher on the hot path
+		Index("ix_homeworks_active_teacher_id", "teacher_id", postgresql_where=active == 1, sqlite_where=active == 1),
+		Index("ix_homeworks_active_group_id", "group_id", postgresql_where=active == 1, sqlite_where=active == 1),
+	)
 
 
 class Student(Base):
@@ -39,7 +65,11 @@ class Student(Base):
 	total_points = Column(Integer, default=0)
 
 	# Relationship: one student can have many submissions
-	submissions = relationship("Submission", back_populates="student")
+	submissions = relationship("Submission", back_populates="student", lazy="raise")
+
+	__table_args__ = (
+		Index("ix_students_total_points", "total_points"),
+	)
 
 
 class Submission(Base):
@@ -53,7 +83,80 @@ class Submission(Base):
 	created_at = Column(DateTime, default=datetime.utcnow)
 	grade = Column(Integer, nullable=True)  # Field for grade
 	is_reviewed = Column(Boolean, default=False)
+	bonus_points = Column(Integer, nullable=False, default=0, server_default="0")
+	# 1-based attempt number per student and homework; unique, so concurrent finalizes cannot exceed the limit
+	attempt = Column(Integer, nullable=True)
+	# Token of the submission flow that created the row; a repeated finalize inserts nothing
+	idempotency_key = Column(String(64), nullable=True)
+
+	# Relationships; lazy loading would block under AsyncSession, so queries
+	# load what they need with the options in repository.py
+	student = relationship("Student", back_populates="submissions", lazy="raise")
+	homework = relationship("Homework", back_populates="submissions", lazy="raise")
+	files = relationship("SubmissionFile", lazy="raise")
+
+	__table_args__ = (
+		# Attempt count in finalize_submission and the review screen filter by both
+		Index("ix_submissions_homework_id_student_id", "homework_id", "student_id"),
+		Index("ix_submissions_student_id", "student_id"),
+		Index("ux_submissions_attempt", "homework_id", "student_id", "attempt", unique=True),
+		Index("ux_submissions_idempotency_key", "idempotency_key", unique=True),
+	)
+
+
+class FSMRecord(Base):
+	__tablename__ = "fsm_states"
+
+	key = Column(String(255), primary_key=True)
+	state = Column(String(255), nullable=True)
+	data = Column(JSON, nullable=False, default=dict)
+	expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class FileBlob(Base):
+	__tablename__ = "file_blobs"
+
+	id = Column(Integer, primary_key=True, autoincrement=True)
+	file_unique_id = Column(String(100), unique=True, nullable=False)
+	sha256 = Column(String(64), nullable=False, index=True)
+	path = Column(String(255), nullable=False)
+	size = Column(Integer, nullable=False)
+	created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class SubmissionFile(Base):
+	__tablename__ = "submission_files"
+
+	id = Column(Integer, primary_key=True, autoincrement=True)
+	submission_id = Column(Integer, ForeignKey("submissions.id"), nullable=False, index=True)
+	# Links to FileBlob.file_unique_id; the blob may still be downloading when this row is written
+	file_unique_id = Column(String(100), nullable=False, index=True)
+	# Looked up by name when a teacher downloads a single file
+	file_name = Column(String(255), nullable=True, index=True)
+
+
+class PointsLedger(Base):
+	"""Append-only record of every change to Student.total_points."""
+	__tablename__ = "points_ledger"
+
+	id = Column(Integer, primary_key=True, autoincrement=True)
+	student_id = Column(Integer, ForeignKey("students.id"), nullable=False, index=True)
+	submission_id = Column(Integer, ForeignKey("submissions.id"), nullable=True, index=True)
+	delta = Column(Integer, nullable=False)
+	reason = Column(String(50), nullable=False)
+	created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ScheduledJob(Base):
+	"""Deadline reminders and auto-close, fired by scheduler.Scheduler."""
+	__tablename__ = "scheduled_jobs"
+
+	id = Column(Integer, primary_key=True, autoincrement=True)
+	kind = Column(String(20), nullable=False)
+	homework_id = Column(Integer, ForeignKey("homeworks.id"), nullable=False, index=True)
+	run_at = Column(DateTime, nullable=False)
+	done = Column(Boolean, nullable=False, default=False)
 
-	# Relationships
-	student = relationship("Student", back_populates="submissions")
-	homework = relationship("Homework", back_populates="submissions")
+	__table_args__ = (
+		Index("ix_scheduled_jobs_pending_run_at", "run_at", postgresql_where=done == False, sqlite_where=done == False),
+	)
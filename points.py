@@ -0,0 +1,99 @@
+# points.py
+from sqlalchemy import case, func, insert, select, update
+
+from cache import TTLCache, MISSING
+from config import LEADERBOARD_CACHE_SIZE, LEADERBOARD_SIZE, LEADERBOARD_TTL
+from model import Group, GroupMember, Homework, PointsLedger, Student, Submission
+
+# Grades a teacher can give, one by one or in bulk
+GRADES = range(1, 6)
+# Bonus points awarded for a grade
+BONUS_POINTS = {5: 3, 4: 2, 3: 1}
+
+# (teacher id, group ids, limit) -> rows
+leaderboard_cache = TTLCache(LEADERBOARD_CACHE_SIZE, LEADERBOARD_TTL)
+
+
+def bonus_for_grade(grade):
+	return BONUS_POINTS.get(grade, 0)
+
+
+async def grade_submission(session, submission_id, grade, teacher_id=None):
+	"""Grade one submission; see :func:`grade_submissions`. Returns the bonus or None."""
+	graded = await grade_submissions(session, {submission_id: grade}, teacher_id)
+	return graded.get(submission_id)
+
+
+async def grade_submissions(session, grades, teacher_id=None):
+	"""Grade many submissions and move their bonuses into student totals by delta.
+
+	``grades`` maps submission id to grade. Runs in the caller's transaction as
+	a fixed number of statements however many submissions are graded: the
+	grades, ledger entries and totals are committed together, and re-grading
+	applies only the difference. With ``teacher_id`` only that teacher's
+	homework is graded. Returns {submission id: bonus} for the graded ones.
+	"""
+	if not grades:
+		return {}
+
+	stmt = select(Submission.id, Submission.student_id, Submission.bonus_points).where(Submission.id.in_(grades))
+	if teacher_id is not None:
+		stmt = stmt.join(Homework, Homework.id == Submission.homework_id).where(Homework.teacher_id == teacher_id)
+	# Lock the rows so concurrent gradings of a submission apply their deltas one after another
+	rows = (await session.execute(stmt.with_for_update(of=Submission))).all()
+	if not rows:
+		return {}
+
+	bonuses = {row.id: bonus_for_grade(grades[row.id]) for row in rows}
+	await session.execute(
+		update(Submission)
+		.where(Submission.id.in_(bonuses))
+		.values(
+			grade=case({submission_id: grades[submission_id] for submission_id in bonuses}, value=Submission.id),
+			bonus_points=case(bonuses, value=Submission.id),
+			is_reviewed=True,
+		)
+	)
+
+	ledger = []
+	student_deltas = {}
+	for row in rows:
+		delta = bonuses[row.id] - (row.bonus_points or 0)
+		if delta:
+			ledger.append({"student_id": row.student_id, "submission_id": row.id, "delta": delta, "reason": "grade"})
+			student_deltas[row.student_id] = student_deltas.get(row.student_id, 0) + delta
+
+	if ledger:
+		await session.execute(insert(PointsLedger), ledger)
+		await session.execute(
+			update(Student)
+			.where(Student.id.in_(student_deltas))
+			.values(total_points=func.coalesce(Student.total_points, 0) + case(student_deltas, value=Student.id))
+		)
+		leaderboard_cache.clear()
+	return bonuses
+
+
+async def leaderboard(session, teacher_id=None, group_ids=(), limit=LEADERBOARD_SIZE):
+	"""Top students by total points, of all a teacher's groups or of ``group_ids``.
+
+	Served from cache between grade changes, one entry per scope.
+	"""
+	group_ids = tuple(sorted(group_ids))
+	key = (teacher_id, group_ids, limit)
+	rows = leaderboard_cache.get(key)
+	if rows is MISSING:
+		members = select(GroupMember.student_id)
+		if teacher_id is not None:
+			members = members.join(Group, Group.id == GroupMember.group_id).where(Group.teacher_id == teacher_id)
+		else:
+			members = members.where(GroupMember.group_id.in_(group_ids))
+		result = await session.execute(
+			select(Student.first_name, Student.last_name, Student.total_points)
+			.where(Student.id.in_(members))
+			.order_by(Student.total_points.desc(), Student.id)
+			.limit(limit)
+		)
+		rows = result.all()
+		leaderboard_cache.set(key, rows)
+	return rows
@@ -0,0 +1,184 @@
+# repository.py
+"""Queries shared by the handlers; each returns only what the caller renders."""
+from datetime import datetime
+
+from sqlalchemy import DateTime, JSON, and_, distinct, func, literal, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import joinedload, raiseload
+
+from config import REVIEW_PAGE_SIZE
+from model import Group, GroupMember, Homework, Student, Submission, SubmissionFile
+
+# Loader options for screens that load Submission objects. Every relationship
+# is lazy="raise", so a screen names what it reads and anything else fails
+# loudly instead of costing a query per row.
+SUBMISSION_ONLY = (raiseload("*"),)
+SUBMISSION_WITH_STUDENT = (joinedload(Submission.student).raiseload("*"), raiseload("*"))
+
+
+def _homework_students(stmt, homework):
+	"""Restrict a query over Student to the students the homework was given to.
+
+	Homework without a group was given to the students of all its teacher's groups.
+	"""
+	if homework.group_id is None:
+		teacher_students = (
+			select(GroupMember.student_id)
+			.join(Group, Group.id == GroupMember.group_id)
+			.where(Group.teacher_id == homework.teacher_id)
+		)
+		return stmt.where(Student.id.in_(teacher_students))
+	return stmt.join(
+		GroupMember, and_(GroupMember.student_id == Student.id, GroupMember.group_id == homework.group_id)
+	)
+
+
+def _insert(dialect):
+	if dialect == "postgresql":
+		return postgresql.insert(Submission)
+	if dialect == "sqlite":
+		return sqlite.insert(Submission)
+	raise NotImplementedError(f"create_submission does not support the {dialect} dialect")
+
+
+async def create_submission(session, homework_id, student_id, idempotency_key, file_ids, file_names):
+	"""Insert the next attempt of a student's submission unless the attempts are used up.
+
+	One ``INSERT ... SELECT ... WHERE attempts < max_attempts`` numbers the
+	attempt; the unique (homework, student, attempt) index rejects a concurrent
+	insert that computed the same number, and the unique ``idempotency_key``
+	makes repeating the same finalize a no-op. Returns ``(id, created)``:
+	``(new id, True)``, ``(existing id, False)`` for a repeated key, or
+	``(None, False)`` when no attempts are left.
+	"""
+	attempts = (
+		select(func.count()).select_from(Submission)
+		.where(Submission.student_id == student_id, Submission.homework_id == homework_id)
+		.scalar_subquery()
+	)
+	source = (
+		select(
+			literal(student_id), literal(homework_id),
+			literal(file_ids, JSON), literal(file_names, JSON),
+			literal(datetime.utcnow(), DateTime), literal(False), attempts + 1, literal(idempotency_key),
+		)
+		.select_from(Homework)
+		.where(Homework.id == homework_id, attempts < Homework.max_attempts)
+	)
+	columns = ["student_id", "homework_id", "file_ids", "file_names", "created_at", "is_reviewed", "attempt", "idempotency_key"]
+	stmt = (
+		_insert(session.bind.dialect.name)
+		.from_select(columns, source)
+		.on_conflict_do_nothing()
+		.returning(Submission.id)
+	)
+
+	for _ in range(2):
+		submission_id = (await session.execute(stmt)).scalar_one_or_none()
+		if submission_id is not None:
+			return submission_id, True
+		existing = await session.execute(select(Submission.id).where(Submission.idempotency_key == idempotency_key))
+		submission_id = existing.scalar_one_or_none()
+		if submission_id is not None:
+			return submission_id, False
+		# Either no attempts are left or a concurrent attempt took this number; the retry tells which
+	return None, False
+
+
+async def get_submission(session, submission_id, options=SUBMISSION_ONLY, teacher_id=None):
+	"""A submission with the relationships ``options`` load, in one query; None if missing.
+
+	With ``teacher_id`` only a submission to that teacher's homework is returned.
+	"""
+	stmt = select(Submission).options(*options).where(Submission.id == submission_id)
+	if teacher_id is not None:
+		stmt = stmt.join(Homework, Homework.id == Submission.homework_id).where(Homework.teacher_id == teacher_id)
+	result = await session.execute(stmt)
+	return result.scalar_one_or_none()
+
+
+async def submission_by_file_name(session, file_name, teacher_id):
+	"""Latest submission to the teacher's homework that contains a file with this name, or None."""
+	result = await session.execute(
+		select(Submission)
+		.options(*SUBMISSION_ONLY)
+		.join(SubmissionFile, SubmissionFile.submission_id == Submission.id)
+		.join(Homework, Homework.id == Submission.homework_id)
+		.where(SubmissionFile.file_name == file_name, Homework.teacher_id == teacher_id)
+		.order_by(Submission.id.desc())
+		.limit(1)
+	)
+	return result.scalar_one_or_none()
+
+
+async def submission_counts(session, homework):
+	"""(submitted, not submitted) student counts for a homework in one query."""
+	stmt = (
+		select(func.count(distinct(Student.id)), func.count(distinct(Submission.student_id)))
+		.select_from(Student)
+		.outerjoin(Submission, and_(Submission.student_id == Student.id, Submission.homework_id == homework.id))
+	)
+	total, submitted = (await session.execute(_homework_students(stmt, homework))).one()
+	return submitted, total - submitted
+
+
+async def _keyset_page(session, stmt, key, after=None, before=None, limit=REVIEW_PAGE_SIZE):
+	"""Stream one page of ``stmt`` ordered by ``key``; returns (rows, has_prev, has_next).
+
+	``after``/``before`` are the last/first key of the neighbouring page, so no
+	OFFSET is needed and every page costs the same regardless of its position.
+	"""
+	if before is not None:
+		stmt = stmt.where(key < before).order_by(key.desc())
+	else:
+		if after is not None:
+			stmt = stmt.where(key > after)
+		stmt = stmt.order_by(key)
+
+	result = await session.stream(stmt.limit(limit + 1))
+	rows = [row async for row in result]
+	has_more = len(rows) > limit
+	rows = rows[:limit]
+
+	if before is not None:
+		rows.reverse()
+		return rows, has_more, True
+	return rows, after is not None, has_more
+
+
+async def review_page(session, homework_id, after=None, before=None, limit=REVIEW_PAGE_SIZE):
+	"""Page of (submission id, file names, student first/last name) for the review keyboard."""
+	stmt = (
+		select(Submission.id, Submission.file_names, Student.first_name, Student.last_name)
+		.join(Student, Student.id == Submission.student_id)
+		.where(Submission.homework_id == homework_id)
+	)
+	return await _keyset_page(session, stmt, Submission.id, after, before, limit)
+
+
+def _not_submitted(columns, homework):
+	stmt = (
+		select(*columns)
+		.outerjoin(Submission, and_(Submission.student_id == Student.id, Submission.homework_id == homework.id))
+		.where(Submission.id.is_(None))
+	)
+	return _homework_students(stmt, homework)
+
+
+async def not_submitted_page(session, homework, after=None, before=None, limit=REVIEW_PAGE_SIZE):
+	"""Page of (student id, first name, last name) without a submission (anti-join)."""
+	stmt = _not_submitted((Student.id, Student.first_name, Student.last_name), homework)
+	return await _keyset_page(session, stmt, Student.id, after, before, limit)
+
+
+async def not_submitted_telegram_ids(session, homework, batch_size):
+	"""Telegram ids of students without a submission, streamed in lists of ``batch_size``."""
+	result = await session.stream(_not_submitted((Student.telegram_id,), homework))
+	async for partition in result.scalars().partitions(batch_size):
+		yield partition
+
+
+async def teacher_groups(session, teacher_id):
+	"""Groups of a teacher, oldest first."""
+	result = await session.execute(select(Group).where(Group.teacher_id == teacher_id).order_by(Group.id))
+	return result.scalars().all()
@@ -0,0 +1,137 @@
+# roster.py
+"""Bulk student import from a CSV roster and streaming CSV export of homework results."""
+import csv
+import io
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects import sqlite
+
+from config import ROSTER_BATCH_SIZE, EXPORT_BATCH_SIZE
+from model import GroupMember, Student, Submission
+
+ROSTER_COLUMNS = ("telegram_id", "phone_number", "first_name", "last_name", "username")
+
+EXPORT_COLUMNS = (
+	"submission_id", "telegram_id", "first_name", "last_name", "username",
+	"submitted_at", "files", "grade", "bonus_points",
+)
+
+# Column widths from model.Student; longer values would fail the whole COPY
+_LIMITS = {"telegram_id": 50, "phone_number": 15, "first_name": 50, "last_name": 50, "username": 50}
+
+
+def parse_roster(content):
+	"""Parse roster CSV text into (records, bad line numbers).
+
+	Columns are ``telegram_id, phone_number, first_name, last_name[, username]``;
+	a header row is skipped. A missing username defaults to the Telegram id,
+	since the column is unique and not null.
+	"""
+	records, bad_lines = [], []
+	for number, row in enumerate(csv.reader(io.StringIO(content)), start=1):
+		row = [value.strip() for value in row]
+		if not any(row):
+			continue
+		if number == 1 and row[0].lower() == "telegram_id":
+			continue
+		if len(row) < 4 or not row[0].isdigit() or not row[1] or not row[2]:
+			bad_lines.append(number)
+			continue
+		record = dict(zip(ROSTER_COLUMNS, row))
+		record.setdefault("username", "")
+		record["username"] = record["username"].lstrip("@") or record["telegram_id"]
+		if any(len(record[column]) > limit for column, limit in _LIMITS.items()):
+			bad_lines.append(number)
+			continue
+		records.append(tuple(record[column] for column in ROSTER_COLUMNS))
+	return records, bad_lines
+
+
+async def import_students(session, records, group_id=None):
+	"""Insert roster records, skipping students that already exist; returns the number added.
+
+	With ``group_id`` every student on the roster, new or existing, is also
+	added to the group. Runs in the caller's transaction.
+	"""
+	if not records:
+		return 0
+	if session.bind.dialect.name == "postgresql":
+		return await _import_copy(session, records, group_id)
+	# SQLite (local runs and the benchmark): batched INSERT ... ON CONFLICT DO NOTHING
+	return await _import_batches(session, records, group_id)
+
+
+async def _import_copy(session, records, group_id):
+	# COPY the roster into a temp table in one round-trip, then merge with SQL
+	connection = await session.connection()
+	raw = await connection.get_raw_connection()
+	await session.execute(text(
+		"CREATE TEMP TABLE roster_import ("
+		"telegram_id varchar(50), phone_number varchar(15), first_name varchar(50), "
+		"last_name varchar(50), username varchar(50)"
+		") ON COMMIT DROP"
+	))
+	await raw.driver_connection.copy_records_to_table("roster_import", records=records, columns=ROSTER_COLUMNS)
+
+	result = await session.execute(text(
+		"INSERT INTO students (telegram_id, phone_number, first_name, last_name, username, total_points) "
+		"SELECT telegram_id, phone_number, first_name, last_name, username, 0 FROM roster_import "
+		"ON CONFLICT DO NOTHING"
+	))
+	if group_id is not None:
+		await session.execute(text(
+			"INSERT INTO group_members (group_id, student_id) "
+			"SELECT :group_id, s.id FROM students s JOIN roster_import r ON r.telegram_id = s.telegram_id "
+			"ON CONFLICT DO NOTHING"
+		), {"group_id": group_id})
+	return result.rowcount
+
+
+async def _import_batches(session, records, group_id):
+	added = 0
+	for start in range(0, len(records), ROSTER_BATCH_SIZE):
+		batch = [dict(zip(ROSTER_COLUMNS, record), total_points=0) for record in records[start:start + ROSTER_BATCH_SIZE]]
+		result = await session.execute(sqlite.insert(Student).on_conflict_do_nothing().returning(Student.id), batch)
+		added += len(result.all())
+
+		if group_id is not None:
+			ids = await session.execute(
+				select(Student.id).where(Student.telegram_id.in_([row["telegram_id"] for row in batch]))
+			)
+			members = [{"group_id": group_id, "student_id": student_id} for student_id in ids.scalars()]
+			if members:
+				await session.execute(sqlite.insert(GroupMember).on_conflict_do_nothing(), members)
+	return added
+
+
+def export_query(homework_id):
+	"""Submissions of a homework with their students, in submission order."""
+	return (
+		select(
+			Submission.id, Student.telegram_id, Student.first_name, Student.last_name, Student.username,
+			Submission.created_at, Submission.file_names, Submission.grade, Submission.bonus_points,
+		)
+		.join(Student, Student.id == Submission.student_id)
+		.where(Submission.homework_id == homework_id)
+		.order_by(Submission.id)
+	)
+
+
+async def export_submissions(session, homework_id, file):
+	"""Write a homework's submissions as CSV to ``file``, a batch of rows at a time."""
+	writer = csv.writer(file)
+	writer.writerow(EXPORT_COLUMNS)
+	count = 0
+	result = await session.stream(export_query(homework_id).execution_options(yield_per=EXPORT_BATCH_SIZE))
+	async for rows in result.partitions():
+		writer.writerows(
+			(
+				submission_id, telegram_id, first_name, last_name, username,
+				f"{created_at:%Y-%m-%d %H:%M:%S}" if created_at else "",
+				";".join(file_names or ()), "" if grade is None else grade, bonus_points,
+			)
+			for submission_id, telegram_id, first_name, last_name, username,
+			created_at, file_names, grade, bonus_points in rows
+		)
+		count += len(rows)
+	return count
@@ -5,6 +5,7 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
 
+from gpt.cache import role_cache
 from gpt.database import async_session
 from gpt.main import router, student_menu, teacher_menu
 from gpt.model import Homework, Teacher, Student
@@ -30,6 +31,7 @@ async def register_teacher(message: types.Message):
             )
             session.add(new_teacher)
             await session.commit()
+            role_cache.invalidate(str(message.from_user.id))
             await message.answer("Вы успешно зарегистрированы как учитель!", reply_markup=teacher_menu)
         except SQLAlchemyError as e:
             await message.answer("Ошибка при регистрации. Попробуйте позже.")
@@ -55,6 +57,7 @@ async def register_student(message: types.Message):
             )
             session.add(new_student)
             await session.commit()
+            role_cache.invalidate(str(message.from_user.id))
             await message.answer("Вы успешно зарегистрированы как студент!", reply_markup=student_menu)
         except SQLAlchemyError as e:
             await message.answer("Ошибка при регистрации. Попробуйте позже.")
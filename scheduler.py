@@ -0,0 +1,144 @@
+# scheduler.py
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta
+
+from aiogram.methods import SendMessage
+from sqlalchemy import select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+import repository
+from cache import active_homeworks
+from config import SCHEDULER_RESYNC_INTERVAL, REMINDER_BATCH_SIZE
+from database import async_session
+from model import Homework, ScheduledJob
+from sender import Sender
+
+# kind -> time before the deadline it fires at
+JOB_OFFSETS = {
+	"remind_24h": timedelta(hours=24),
+	"remind_1h": timedelta(hours=1),
+	"close": timedelta(0),
+}
+
+REMINDER_TEXT = {
+	"remind_24h": "До дедлайна осталось 24 часа",
+	"remind_1h": "До дедлайна остался 1 час",
+}
+
+
+class Scheduler:
+	"""Fires deadline jobs stored in ``scheduled_jobs`` from an in-memory min-heap.
+
+	Pending jobs are reloaded at start and every ``resync_interval`` seconds, so
+	jobs created by another worker are picked up too. A job is claimed with a
+	conditional UPDATE before it runs, so it fires once across all workers.
+	"""
+
+	def __init__(self, sender: Sender, resync_interval: float = SCHEDULER_RESYNC_INTERVAL):
+		self.sender = sender
+		self.resync_interval = resync_interval
+		self._heap = []
+		self._known = set()
+		self._wakeup = asyncio.Event()
+		self._task = None
+		self._last_sync = datetime.min
+
+	@staticmethod
+	def jobs_for(homework):
+		"""Jobs for a new homework; deadlines already too close skip their reminder."""
+		now = datetime.now()
+		jobs = []
+		for kind, offset in JOB_OFFSETS.items():
+			run_at = homework.deadline - offset
+			if run_at > now or kind == "close":
+				jobs.append(ScheduledJob(kind=kind, homework_id=homework.id, run_at=run_at))
+		return jobs
+
+	def push(self, jobs):
+		"""Add committed jobs to the heap and wake the loop if one became the next due."""
+		for job in jobs:
+			if job.id not in self._known:
+				self._known.add(job.id)
+				heapq.heappush(self._heap, (job.run_at, job.id, job.kind, job.homework_id))
+		self._wakeup.set()
+
+	async def _load(self):
+		async with async_session() as session:
+			jobs_query = await session.execute(select(ScheduledJob).where(ScheduledJob.done == False))
+			self.push(jobs_query.scalars())
+		self._last_sync = datetime.now()
+
+	async def start(self):
+		await self._load()
+		self._task = asyncio.create_task(self._run())
+
+	async def _run(self):
+		while True:
+			self._wakeup.clear()
+			timeout = self.resync_interval
+			if self._heap:
+				timeout = min(timeout, max(0.0, (self._heap[0][0] - datetime.now()).total_seconds()))
+			try:
+				await asyncio.wait_for(self._wakeup.wait(), timeout)
+			except asyncio.TimeoutError:
+				pass
+
+			try:
+				if (datetime.now() - self._last_sync).total_seconds() >= self.resync_interval:
+					await self._load()
+				while self._heap and self._heap[0][0] <= datetime.now():
+					run_at, job_id, kind, homework_id = heapq.heappop(self._heap)
+					self._known.discard(job_id)
+					await self._fire(job_id, kind, homework_id)
+			except SQLAlchemyError as e:
+				logging.error("Scheduler database error: %s", e)
+			except Exception:
+				logging.exception("Scheduler job failed")
+
+	async def _fire(self, job_id, kind, homework_id):
+		async with async_session() as session:
+			claimed = await session.execute(
+				update(ScheduledJob).where(ScheduledJob.id == job_id, ScheduledJob.done == False).values(done=True)
+			)
+			if claimed.rowcount != 1:
+				await session.rollback()
+				return
+
+			homework = await session.get(Homework, homework_id)
+			if kind == "close":
+				await session.execute(
+					update(Homework).where(Homework.id == homework_id, Homework.active == 1).values(active=0)
+				)
+				await active_homeworks.notify(session)
+				await session.commit()
+				await active_homeworks.refresh()
+				logging.info("Homework %s closed at its deadline", homework_id)
+				return
+			await session.commit()
+
+		if homework is not None and homework.active == 1:
+			await self._remind(homework, kind)
+
+	async def _remind(self, homework, kind):
+		"""Queue a reminder for every student who has not submitted yet."""
+		text = (
+			f"{REMINDER_TEXT[kind]}.\n"
+			f"Домашнее задание: {homework.description}\n"
+			f"Дедлайн: {homework.deadline:%Y-%m-%d %H:%M}"
+		)
+		sent = 0
+		async with async_session() as session:
+			async for telegram_ids in repository.not_submitted_telegram_ids(session, homework, REMINDER_BATCH_SIZE):
+				for telegram_id in telegram_ids:
+					# Waits when the fan-out places are taken, so it follows the rate limit
+					await self.sender.enqueue(SendMessage(chat_id=telegram_id, text=text))
+				sent += len(telegram_ids)
+		logging.info("Queued %d %s reminders for homework %s", sent, kind, homework.id)
+
+	async def close(self):
+		if self._task is not None:
+			self._task.cancel()
+			await asyncio.gather(self._task, return_exceptions=True)
+			self._task = None
@@ -0,0 +1,175 @@
+# sender.py
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendDocument, SendMediaGroup, TelegramMethod
+from aiogram.types import InputMediaDocument
+
+from config import (
+	SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_MAX_RETRIES, SEND_WORKERS, SEND_QUEUE_SIZE,
+	SEND_BULK_QUEUE_SIZE, SEND_DRAIN_TIMEOUT,
+)
+
+MEDIA_GROUP_LIMIT = 10
+
+
+class TokenBucket:
+	"""Allows ``rate`` acquisitions per second with bursts of up to ``capacity``."""
+
+	__slots__ = ("rate", "capacity", "tokens", "updated")
+
+	def __init__(self, rate: float, capacity: float):
+		self.rate = rate
+		self.capacity = capacity
+		self.tokens = capacity
+		self.updated = time.monotonic()
+
+	def _refill(self):
+		now = time.monotonic()
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def try_acquire(self, tokens: float = 1) -> bool:
+		self._refill()
+		if self.tokens >= tokens:
+			self.tokens -= tokens
+			return True
+		return False
+
+	def is_full(self) -> bool:
+		self._refill()
+		return self.tokens >= self.capacity
+
+	async def acquire(self, tokens: float = 1):
+		while not self.try_acquire(tokens):
+			await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+class Sender:
+	"""Outbound Telegram calls limited globally and per chat, retried on 429.
+
+	:meth:`call` sends and waits for the result; :meth:`submit` queues a call
+	for background workers (notifications) and returns immediately;
+	:meth:`enqueue` queues fan-outs (reminders). Fan-outs hold at most
+	``bulk_queue_size`` places in the queue, so they cannot crowd out
+	notifications.
+	"""
+
+	def __init__(
+			self,
+			bot: Bot,
+			global_rate: float = SEND_GLOBAL_RATE,
+			chat_rate: float = SEND_CHAT_RATE,
+			chat_burst: int = SEND_CHAT_BURST,
+			workers: int = SEND_WORKERS,
+			queue_size: int = SEND_QUEUE_SIZE,
+			bulk_queue_size: int = SEND_BULK_QUEUE_SIZE,
+	):
+		self.bot = bot
+		self.global_bucket = TokenBucket(global_rate, global_rate)
+		self.chat_rate = chat_rate
+		self.chat_burst = chat_burst
+		self.chat_buckets = {}
+		self.workers = workers
+		self.queue_size = queue_size
+		self.bulk_queue_size = bulk_queue_size
+		self._bulk_slots = asyncio.Semaphore(bulk_queue_size)
+		# Notifications queued; fan-outs are counted by _bulk_slots
+		self._pending = 0
+		self._queue = None
+		self._worker_tasks = []
+
+	def _chat_bucket(self, chat_id) -> TokenBucket:
+		bucket = self.chat_buckets.get(chat_id)
+		if bucket is None:
+			if len(self.chat_buckets) > 10000:
+				# A full bucket behaves like a new one, so idle chats can be dropped
+				self.chat_buckets = {key: value for key, value in self.chat_buckets.items() if not value.is_full()}
+			bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+		return bucket
+
+	async def call(self, method: TelegramMethod):
+		"""Send ``method`` once both rate limits allow it, retrying on flood errors."""
+		chat_id = getattr(method, "chat_id", None)
+		for attempt in range(SEND_MAX_RETRIES + 1):
+			if chat_id is not None:
+				await self._chat_bucket(chat_id).acquire()
+			await self.global_bucket.acquire()
+			try:
+				return await self.bot(method)
+			except TelegramRetryAfter as e:
+				if attempt == SEND_MAX_RETRIES:
+					raise
+				logging.warning("Flood limit hit for chat %s, retrying in %s s", chat_id, e.retry_after)
+				await asyncio.sleep(e.retry_after)
+
+	async def send_documents(self, chat_id, file_ids, caption=None):
+		"""Send files as media groups of up to 10 documents per API call."""
+		for start in range(0, len(file_ids), MEDIA_GROUP_LIMIT):
+			chunk = file_ids[start:start + MEDIA_GROUP_LIMIT]
+			if len(chunk) == 1:
+				await self.call(SendDocument(chat_id=chat_id, document=chunk[0], caption=caption))
+			else:
+				media = [InputMediaDocument(media=file_id) for file_id in chunk[:-1]]
+				media.append(InputMediaDocument(media=chunk[-1], caption=caption))
+				await self.call(SendMediaGroup(chat_id=chat_id, media=media))
+
+	def _ensure_workers(self):
+		if self._queue is None:
+			# Bounded by the two counts instead: queue_size notifications plus the bulk slots
+			self._queue = asyncio.Queue()
+			self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+	def submit(self, method: TelegramMethod) -> bool:
+		"""Queue ``method`` for the background workers; drop it if the queue is full.
+
+		Returns whether it was queued. Use :meth:`enqueue` where waiting is fine.
+		"""
+		self._ensure_workers()
+		if self._pending >= self.queue_size:
+			logging.warning(
+				"Send queue is full, dropping %s to chat %s", type(method).__name__, getattr(method, "chat_id", None)
+			)
+			return False
+		self._pending += 1
+		self._queue.put_nowait((method, False))
+		return True
+
+	async def enqueue(self, method: TelegramMethod):
+		"""Queue ``method``, waiting for a place among the fan-out ones; use for large fan-outs."""
+		await self._bulk_slots.acquire()
+		self._ensure_workers()
+		self._queue.put_nowait((method, True))
+
+	async def _worker(self):
+		while True:
+			method, bulk = await self._queue.get()
+			try:
+				await self.call(method)
+			except Exception as e:
+				logging.error("Failed to send %s: %s", type(method).__name__, e)
+			finally:
+				if bulk:
+					self._bulk_slots.release()
+				else:
+					self._pending -= 1
+				self._queue.task_done()
+
+	async def close(self, timeout: float = SEND_DRAIN_TIMEOUT):
+		"""Wait up to ``timeout`` for queued calls to be sent, then stop the workers and drop the rest."""
+		if self._queue is None:
+			return
+		try:
+			await asyncio.wait_for(self._queue.join(), timeout)
+		except asyncio.TimeoutError:
+			logging.warning("Dropping %d queued sends after the drain timeout", self._queue.qsize())
+		for task in self._worker_tasks:
+			task.cancel()
+		await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+		self._queue = None
+		self._worker_tasks = []
+		self._pending = 0
+		self._bulk_slots = asyncio.Semaphore(self.bulk_queue_size)
@@ -0,0 +1,146 @@
+# tests/conftest.py
+"""Run the bot offline against a throwaway SQLite database and a fake Bot API.
+
+Environment is set before the app is imported, so config picks it up: local
+database, in-memory FSM, no send or per-user rate limits.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="bot-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_tmp}/test.sqlite"
+os.environ["FSM_STORAGE"] = "memory"
+os.environ["FILE_STORE_DIR"] = os.path.join(_tmp, "files")
+os.environ["HOMEWORK_NOTIFY"] = "0"
+for name in ("SEND_GLOBAL_RATE", "SEND_CHAT_RATE", "SEND_CHAT_BURST"):
+	os.environ[name] = "1000000"
+for profile in ("", "UPLOAD_", "DOWNLOAD_"):
+	os.environ[f"THROTTLE_{profile}RATE"] = "1000000"
+	os.environ[f"THROTTLE_{profile}BURST"] = "1000000"
+
+from aiogram import BaseMiddleware  # noqa: E402
+
+import main  # noqa: E402
+import points  # noqa: E402
+from recorder import StatementRecorder  # noqa: E402
+from cache import active_homeworks, group_cache, role_cache  # noqa: E402
+from database import Base, async_session, engine  # noqa: E402
+from fake_telegram import FakeSession  # noqa: E402
+from model import Group, GroupMember, Homework, Student, Submission, SubmissionFile, Teacher  # noqa: E402
+
+TEACHER_ID = 1
+STUDENT_BASE_ID = 1000
+
+
+class HandlerLog(BaseMiddleware):
+	"""Remembers the name of every handler that ran."""
+
+	def __init__(self):
+		self.names = []
+
+	async def __call__(self, handler, event, data):
+		self.names.append(data["handler"].callback.__name__)
+		return await handler(event, data)
+
+
+handler_log = HandlerLog()
+
+
+@pytest.fixture(scope="session")
+def loop():
+	loop = asyncio.new_event_loop()
+	main.bot.session = FakeSession()
+	# Return from feed_update only once the handler has finished
+	main.update_queue.wait_for_result = True
+	main.router.message.middleware(handler_log)
+	main.router.callback_query.middleware(handler_log)
+	main.dp.include_router(main.router)
+	yield loop
+	loop.run_until_complete(main.sender.close())
+	loop.run_until_complete(main.file_store.close())
+	loop.run_until_complete(engine.dispose())
+	loop.close()
+
+
+@pytest.fixture
+def run(loop):
+	return loop.run_until_complete
+
+
+async def _feed(update):
+	await main.dp.feed_update(main.bot, update)
+	# Background work the update queued counts towards it: downloads, notifications
+	await main.file_store.close()
+	await main.sender.close()
+
+
+@pytest.fixture
+def feed(run):
+	"""Feed one update through the dispatcher; returns the Bot API calls it made."""
+	def feed(update):
+		sent = main.bot.session.sent
+		sent.clear()
+		handler_log.names.clear()
+		run(_feed(update))
+		return list(sent)
+	return feed
+
+
+@pytest.fixture(scope="session")
+def recorder():
+	"""Statements executed on ``database.engine``; use ``with recorder.record() as recording``."""
+	recorder = StatementRecorder(engine)
+	yield recorder
+	recorder.close()
+
+
+async def _seed(students):
+	async with engine.begin() as conn:
+		await conn.run_sync(Base.metadata.drop_all)
+	await main.create_tables()
+	for cache in (role_cache, group_cache, points.leaderboard_cache):
+		cache.clear()
+	await main.dp.fsm.get_context(main.bot, chat_id=TEACHER_ID, user_id=TEACHER_ID).clear()
+
+	async with async_session() as session:
+		teacher = Teacher(telegram_id=str(TEACHER_ID), name="Teacher")
+		session.add(teacher)
+		await session.flush()
+		group = Group(teacher_id=teacher.id, name="Class", code="class")
+		# Homework without a group goes to all the teacher's groups
+		homework = Homework(description="Homework", deadline=datetime(2099, 1, 1), teacher_id=teacher.id)
+		session.add_all((group, homework))
+		await session.flush()
+		for n in range(students):
+			uid = STUDENT_BASE_ID + n
+			student = Student(
+				telegram_id=str(uid), phone_number=f"+{uid}", first_name=f"First{n}", last_name=f"Last{n}",
+				username=f"user{uid}", total_points=0,
+			)
+			session.add(student)
+			await session.flush()
+			session.add(GroupMember(group_id=group.id, student_id=student.id))
+			submission = Submission(
+				student_id=student.id, homework_id=homework.id, file_ids=[f"file-{n}"], file_names=[f"solution_{n}.py"],
+				attempt=1,
+			)
+			session.add(submission)
+			await session.flush()
+			session.add(SubmissionFile(submission_id=submission.id, file_unique_id=f"u-file-{n}", file_name=f"solution_{n}.py"))
+		await session.commit()
+	await active_homeworks.refresh()
+	return homework.id
+
+
+@pytest.fixture
+def classroom(run, request):
+	"""A teacher with one active homework and a group of ``request.param`` students who all submitted it."""
+	return run(_seed(request.param))
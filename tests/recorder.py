@@ -0,0 +1,97 @@
+# tests/recorder.py
+"""Record the SQL statements an engine executes and the rows each one returns."""
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import List
+
+from sqlalchemy import event
+
+
+@dataclass
+class Statement:
+	sql: str
+	parameters: object
+	rows: int = 0
+
+	def __str__(self):
+		return f"[{self.rows} rows] {' '.join(self.sql.split())}"
+
+
+@dataclass
+class Recording:
+	statements: List[Statement] = field(default_factory=list)
+
+	@property
+	def count(self):
+		return len(self.statements)
+
+	@property
+	def rows(self):
+		return sum(statement.rows for statement in self.statements)
+
+	def __str__(self):
+		return "\n".join(str(statement) for statement in self.statements) or "(no statements)"
+
+
+class _CountingCursor:
+	"""Wraps a DBAPI cursor and adds every row fetched through it to ``statement.rows``."""
+
+	def __init__(self, cursor, statement: Statement):
+		self._cursor = cursor
+		self._statement = statement
+
+	def fetchone(self):
+		row = self._cursor.fetchone()
+		if row is not None:
+			self._statement.rows += 1
+		return row
+
+	def fetchmany(self, *args, **kwargs):
+		rows = self._cursor.fetchmany(*args, **kwargs)
+		self._statement.rows += len(rows)
+		return rows
+
+	def fetchall(self):
+		rows = self._cursor.fetchall()
+		self._statement.rows += len(rows)
+		return rows
+
+	def __getattr__(self, name):
+		return getattr(self._cursor, name)
+
+
+class StatementRecorder:
+	"""Listens on an engine; :meth:`record` collects what runs inside its block.
+
+	Rows are counted as the result is consumed, so a statement streamed with
+	``yield_per`` counts what the caller actually fetched from the database.
+	RETURNING rows of a batched executemany insert are read by SQLAlchemy
+	itself and not counted.
+	"""
+
+	def __init__(self, engine):
+		self.sync_engine = getattr(engine, "sync_engine", engine)
+		self._recordings = []
+		event.listen(self.sync_engine, "after_cursor_execute", self._after_cursor_execute)
+
+	def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+		if not self._recordings:
+			return
+		recorded = Statement(statement, parameters)
+		for recording in self._recordings:
+			recording.statements.append(recorded)
+		# The result reads rows through context.cursor, which is set up after this event
+		if context is not None and cursor.description is not None and context.cursor is cursor:
+			context.cursor = _CountingCursor(cursor, recorded)
+
+	@contextmanager
+	def record(self):
+		recording = Recording()
+		self._recordings.append(recording)
+		try:
+			yield recording
+		finally:
+			self._recordings.remove(recording)
+
+	def close(self):
+		event.remove(self.sync_engine, "after_cursor_execute", self._after_cursor_execute)
@@ -0,0 +1,45 @@
+# tests/test_bulk_grading.py
+"""Grade input: leaving bulk grading, reading CSV files and the range of grades."""
+import pytest
+
+import main
+from callbacks import GradeSubmission
+from conftest import TEACHER_ID, handler_log
+from fake_telegram import callback, document, message
+
+
+def _state(run):
+	return run(main.dp.fsm.get_context(main.bot, chat_id=TEACHER_ID, user_id=TEACHER_ID).get_state())
+
+
+@pytest.mark.parametrize("classroom", (1,), indirect=True)
+def test_commands_and_cancel_leave_bulk_grading(classroom, run, feed):
+	feed(message(TEACHER_ID, "Массовая оценка"))
+	feed(message(TEACHER_ID, "/groups"))
+	assert handler_log.names == ["list_groups"]
+	assert _state(run) == "BulkGrading:waiting_for_grades"
+
+	assert [method.text for method in feed(message(TEACHER_ID, "/cancel"))] == ["Действие отменено."]
+	assert _state(run) is None
+
+
+@pytest.mark.parametrize("classroom", (1,), indirect=True)
+def test_failed_attempt_ends_bulk_grading(classroom, run, feed):
+	feed(message(TEACHER_ID, "Массовая оценка"))
+	sent = feed(message(TEACHER_ID, "no grades here"))
+	assert "Не найдено ни одной строки" in sent[0].text
+	assert _state(run) is None
+
+
+@pytest.mark.parametrize("classroom", (1,), indirect=True)
+def test_grades_from_cp1251_csv(classroom, feed):
+	feed(message(TEACHER_ID, "Массовая оценка"))
+	sent = feed(document(TEACHER_ID, "grades.csv", "ID,оценка\n1,5\n".encode("cp1251")))
+	assert sent[-1].text == "Оценено решений: 1.\nПропущены строки: 1."
+
+
+@pytest.mark.parametrize("classroom", (1,), indirect=True)
+def test_single_grade_has_the_bulk_range(classroom, feed):
+	feed(callback(TEACHER_ID, GradeSubmission(id=1).pack()))
+	assert [method.text for method in feed(message(TEACHER_ID, "7"))] == ["Оценка должна быть от 1 до 5."]
+	assert "оценено на 5" in feed(message(TEACHER_ID, "5"))[0].text
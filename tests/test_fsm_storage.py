@@ -0,0 +1,25 @@
+# tests/test_fsm_storage.py
+"""SQLStorage writes state changes through and buffers data-only writes."""
+from aiogram.fsm.storage.base import StorageKey
+
+import main
+from database import async_session
+from fsm_storage import SQLStorage
+
+KEY = StorageKey(bot_id=42, chat_id=7, user_id=7)
+
+
+def test_state_is_visible_to_other_workers_at_once(run):
+	run(main.create_tables())
+	worker, other = SQLStorage(async_session, flush_interval=60), SQLStorage(async_session, flush_interval=60)
+
+	run(worker.set_data(KEY, {"step": 1}))
+	run(worker.set_state(KEY, "Registration:waiting_for_name"))
+	assert run(other.get_state(KEY)) == "Registration:waiting_for_name"
+	# Data buffered before the state change went out with it
+	assert run(other.get_data(KEY)) == {"step": 1}
+
+	run(worker.set_data(KEY, {"step": 2}))
+	assert run(other.get_data(KEY)) == {"step": 1}
+	run(worker.close())
+	assert run(other.get_data(KEY)) == {"step": 2}
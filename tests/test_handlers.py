@@ -0,0 +1,183 @@
+# tests/test_handlers.py
+"""Statement and row budgets for every handler in main.py, and what grading does to points.
+
+Each handler runs once against a class of ``CLASS_SIZE`` students who all
+submitted the homework. Budgets are maxima per invocation, background work it
+queued included. The class is larger than any row budget, so a handler that
+loads a whole table (``select(Student)`` and the like) or queries once per
+student fails here instead of in production.
+"""
+import re
+
+import pytest
+from sqlalchemy import select
+
+import main
+from callbacks import (
+	DownloadSubmission, GradeSubmission, HomeworkGroup, MissingPage, ReviewPage, SelectSubmission, SubmitHomework,
+)
+from conftest import STUDENT_BASE_ID, TEACHER_ID, handler_log
+from database import async_session
+from fake_telegram import callback, document, message
+from model import PointsLedger, Student
+
+CLASS_SIZE = 50
+NEW_STUDENT_ID = 5000
+
+ROSTER_SIZE = 20
+
+# handler -> (max statements, max rows fetched); a cold role cache costs 2 statements
+BUDGETS = {
+	"start_command": (2, 1),
+	"handle_phone_number": (0, 0),
+	"handle_full_name": (1, 0),
+	"create_group": (1, 0),
+	"list_groups": (1, 3),
+	"join_group": (4, 2),
+	"create_homework": (1, 3),
+	"choose_homework_group": (0, 0),
+	"set_deadline": (0, 0),
+	# Closes the previous homework, inserts the new one and its reminders, reloads active homework
+	"save_homework": (6, 2),
+	"view_homework": (1, 1),
+	# Counts, then one page plus the row that tells whether there is a next page
+	"review_submissions": (2, 12),
+	"handle_review_page": (2, 12),
+	"handle_submission_selection": (1, 1),
+	"handle_download": (1, 1),
+	"download_submission": (1, 1),
+	"prompt_for_grade": (1, 1),
+	"grade_submission": (4, 1),
+	"start_bulk_grading": (0, 0),
+	"cancel": (0, 0),
+	"apply_bulk_grades": (4, 3),
+	"show_leaderboard": (1, 10),
+	"start_roster_import": (1, 1),
+	"import_roster": (3, ROSTER_SIZE),
+	# The export is the one screen that reads the whole homework, streamed
+	"export_homework": (2, CLASS_SIZE + 1),
+	"handle_callback": (0, 0),
+	"ask_for_submission": (3, 2),
+	"choose_submission_homework": (0, 0),
+	"handle_submission": (2, 0),
+	"finalize_submission": (3, 2),
+}
+
+
+def router_handlers():
+	return {
+		handler.callback.__name__
+		for observer in (main.router.message, main.router.callback_query)
+		for handler in observer.handlers
+	}
+
+
+def _text(sent):
+	return "\n".join(getattr(method, "text", None) or "" for method in sent)
+
+
+@pytest.mark.parametrize("classroom", (CLASS_SIZE,), indirect=True)
+def test_handler_budgets(classroom, feed, recorder):
+	homework_id = classroom
+	recordings = []
+
+	def run(handler, update):
+		with recorder.record() as recording:
+			sent = feed(update)
+		assert handler_log.names == [handler], f"expected {handler}, ran {handler_log.names}"
+		recordings.append((handler, recording))
+		return sent
+
+	# Teacher
+	run("start_command", message(TEACHER_ID, "/start"))
+	sent = run("create_group", message(TEACHER_ID, "/newgroup 10A"))
+	code = re.search(r"/join (\w+)", _text(sent)).group(1)
+	# With two groups creating homework asks which one it is for
+	run("create_group", message(TEACHER_ID, "/newgroup 10B"))
+	run("list_groups", message(TEACHER_ID, "/groups"))
+	run("review_submissions", message(TEACHER_ID, "Проверить домашки"))
+	run("create_homework", message(TEACHER_ID, "Создать домашнее задание"))
+	run("choose_homework_group", callback(TEACHER_ID, HomeworkGroup(id=1).pack()))
+	run("set_deadline", message(TEACHER_ID, "Group homework"))
+	run("save_homework", message(TEACHER_ID, "2099-01-01 10:00"))
+	run("view_homework", message(TEACHER_ID, "Посмотреть домашнее задание"))
+	# Two active homeworks now: the teacher picks one first
+	run("review_submissions", message(TEACHER_ID, "Проверить домашки"))
+	run("handle_review_page", callback(TEACHER_ID, ReviewPage(hw=homework_id, after=0).pack()))
+	run("handle_review_page", callback(TEACHER_ID, MissingPage(hw=homework_id).pack()))
+	run("handle_submission_selection", callback(TEACHER_ID, SelectSubmission(id=1).pack()))
+	run("handle_download", callback(TEACHER_ID, DownloadSubmission(id=1).pack()))
+	run("download_submission", message(TEACHER_ID, "Скачать solution_0.py"))
+	run("prompt_for_grade", callback(TEACHER_ID, GradeSubmission(id=1).pack()))
+	run("grade_submission", message(TEACHER_ID, "5"))
+	run("show_leaderboard", message(TEACHER_ID, "/leaderboard"))
+	run("start_bulk_grading", message(TEACHER_ID, "Массовая оценка"))
+	run("cancel", message(TEACHER_ID, "/cancel"))
+	run("start_bulk_grading", message(TEACHER_ID, "Массовая оценка"))
+	run("apply_bulk_grades", message(TEACHER_ID, "2 4\n3 5\n4 3"))
+	run("start_roster_import", message(TEACHER_ID, f"/import {code}"))
+	roster = "telegram_id,phone_number,first_name,last_name\n" + "".join(
+		f"{uid},+{uid},Imported,Student{uid}\n" for uid in range(9000, 9000 + ROSTER_SIZE)
+	)
+	run("import_roster", document(TEACHER_ID, "roster.csv", roster.encode()))
+	run("export_homework", message(TEACHER_ID, f"/export {homework_id}"))
+	run("handle_callback", callback(TEACHER_ID, "stale"))
+
+	# A new student registers, joins the group and submits
+	run("start_command", message(NEW_STUDENT_ID, "/start"))
+	run("handle_phone_number", message(
+		NEW_STUDENT_ID, contact={"phone_number": f"+{NEW_STUDENT_ID}", "first_name": "New", "user_id": NEW_STUDENT_ID},
+	))
+	run("handle_full_name", message(NEW_STUDENT_ID, "New Student"))
+	run("join_group", message(NEW_STUDENT_ID, f"/join {code}"))
+	run("view_homework", message(NEW_STUDENT_ID, "Посмотреть домашнее задание"))
+	run("ask_for_submission", message(NEW_STUDENT_ID, "Отправить решение"))
+	run("handle_submission", document(NEW_STUDENT_ID, "solution.py"))
+	sent = run("finalize_submission", message(NEW_STUDENT_ID, "Завершить отправку"))
+	assert "успешно отправлено" in _text(sent)
+
+	# An existing student of the class has two active homeworks and picks one
+	run("ask_for_submission", message(STUDENT_BASE_ID, "Отправить решение"))
+	run("choose_submission_homework", callback(STUDENT_BASE_ID, SubmitHomework(id=homework_id).pack()))
+
+	assert {name for name, _ in recordings} == set(BUDGETS)
+	over = [
+		f"{name}: {recording.count} statements, {recording.rows} rows; budget {BUDGETS[name]}\n{recording}"
+		for name, recording in recordings
+		if recording.count > BUDGETS[name][0] or recording.rows > BUDGETS[name][1]
+	]
+	assert not over, "\n\n".join(over)
+
+
+def test_every_handler_has_budget():
+	assert router_handlers() == set(BUDGETS)
+
+
+async def _points(student_id):
+	async with async_session() as session:
+		total = await session.scalar(select(Student.total_points).where(Student.id == student_id))
+		deltas = (await session.execute(
+			select(PointsLedger.delta).where(PointsLedger.student_id == student_id).order_by(PointsLedger.id)
+		)).scalars().all()
+	return total, deltas
+
+
+@pytest.mark.parametrize("classroom", (2,), indirect=True)
+def test_regrading_applies_only_the_difference(classroom, run, feed):
+	def grade(text):
+		feed(callback(TEACHER_ID, GradeSubmission(id=1).pack()))
+		feed(message(TEACHER_ID, text))
+
+	grade("5")
+	assert run(_points(1)) == (3, [3])
+	grade("3")
+	assert run(_points(1)) == (1, [3, -2])
+	# Same grade again: nothing to move
+	grade("3")
+	assert run(_points(1)) == (1, [3, -2])
+
+	# Bulk grading goes through the same deltas
+	feed(message(TEACHER_ID, "Массовая оценка"))
+	feed(message(TEACHER_ID, "1 4\n2 5"))
+	assert run(_points(1)) == (2, [3, -2, 1])
+	assert run(_points(2)) == (3, [3])
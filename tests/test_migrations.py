@@ -0,0 +1,56 @@
+# tests/test_migrations.py
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, select
+
+import migrations
+from database import Base
+from model import Group, GroupMember, Homework, ScheduledJob, Student, Teacher
+
+
+def test_active_homework_gets_deadline_jobs():
+	engine = create_engine("sqlite://")
+	with engine.begin() as conn:
+		Base.metadata.create_all(conn)
+		conn.execute(Teacher.__table__.insert(), {"id": 1, "telegram_id": "1", "name": "T"})
+		soon = datetime.now() + timedelta(minutes=30)
+		conn.execute(Homework.__table__.insert(), [
+			{"id": 1, "description": "open", "deadline": soon, "active": 1, "teacher_id": 1},
+			{"id": 2, "description": "closed", "deadline": soon, "active": 0, "teacher_id": 1},
+			{"id": 3, "description": "scheduled", "deadline": soon, "active": 1, "teacher_id": 1},
+		])
+		conn.execute(ScheduledJob.__table__.insert(), {"kind": "close", "homework_id": 3, "run_at": soon, "done": False})
+
+		migrations.migrate(conn)
+		migrations.migrate(conn)
+
+		jobs = conn.execute(select(ScheduledJob.homework_id, ScheduledJob.kind).order_by(ScheduledJob.id)).all()
+	# Reminders already past their time are skipped, the close job never is
+	assert sorted(tuple(job) for job in jobs) == [(1, "close"), (3, "close")]
+
+
+def test_ungrouped_students_join_a_default_group_per_teacher():
+	engine = create_engine("sqlite://")
+	with engine.begin() as conn:
+		Base.metadata.create_all(conn)
+		conn.execute(Teacher.__table__.insert(), [
+			{"id": 1, "telegram_id": "1", "name": "A"},
+			{"id": 2, "telegram_id": "2", "name": "B"},
+		])
+		conn.execute(Student.__table__.insert(), [
+			{"id": n, "telegram_id": str(100 + n), "phone_number": f"+{n}", "first_name": "S", "last_name": str(n),
+			 "username": f"s{n}"}
+			for n in (1, 2)
+		])
+		conn.execute(Group.__table__.insert(), {"id": 1, "teacher_id": 1, "name": "Joined", "code": "joined"})
+		conn.execute(GroupMember.__table__.insert(), {"group_id": 1, "student_id": 2})
+
+		migrations.migrate(conn)
+		migrations.migrate(conn)
+
+		members = conn.execute(
+			select(Group.teacher_id, Group.name, GroupMember.student_id).join(Group, Group.id == GroupMember.group_id)
+		).all()
+	assert sorted(tuple(member) for member in members) == [
+		(1, "Joined", 2), (1, migrations.DEFAULT_GROUP_NAME, 1), (2, migrations.DEFAULT_GROUP_NAME, 1),
+	]
@@ -0,0 +1,69 @@
+# tests/test_ordering.py
+"""Updates of one user run in order, and each sees the state the previous one left."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+from fake_telegram import message
+from ordering import OrderedUpdateMiddleware
+
+NEW_STUDENT_ID = 6000
+
+
+async def _feed_queued(*updates):
+	# Both updates are queued before the first one runs, as when polling
+	for update in updates:
+		await main.dp.feed_update(main.bot, update)
+	await main.update_queue.close()
+	await main.sender.close()
+
+
+@pytest.mark.parametrize("classroom", (0,), indirect=True)
+def test_queued_update_sees_state_set_before_it(classroom, run, monkeypatch):
+	monkeypatch.setattr(main.update_queue, "wait_for_result", False)
+
+	run(_feed_queued(
+		message(NEW_STUDENT_ID, "/start"),
+		message(NEW_STUDENT_ID, contact={
+			"phone_number": f"+{NEW_STUDENT_ID}", "first_name": "New", "user_id": NEW_STUDENT_ID,
+		}),
+	))
+
+	state = main.dp.fsm.get_context(main.bot, chat_id=NEW_STUDENT_ID, user_id=NEW_STUDENT_ID)
+	assert run(state.get_state()) == "Registration:waiting_for_name"
+
+
+def _update(n):
+	return SimpleNamespace(update_id=n, event=SimpleNamespace(from_user=SimpleNamespace(id=1)))
+
+
+async def _put_woken_while_queue_drains():
+	queue = OrderedUpdateMiddleware(workers=1, user_queue_size=2, max_pending=100)
+	release = asyncio.Event()
+	seen = []
+
+	async def handler(update, data):
+		seen.append(update.update_id)
+		# Only the first update yields; the rest are handled back to back
+		if update.update_id == 1:
+			await release.wait()
+
+	await queue(handler, _update(1), {})
+	await asyncio.sleep(0)
+	await queue(handler, _update(2), {})
+	await queue(handler, _update(3), {})
+	# The queue is full: this put waits, and the get of update 2 wakes it
+	putter = asyncio.create_task(queue(handler, _update(4), {}))
+	await asyncio.sleep(0)
+	release.set()
+	await putter
+	await asyncio.gather(*queue._workers.values())
+	return seen, queue
+
+
+def test_put_waiting_for_room_is_not_orphaned(run):
+	seen, queue = run(_put_woken_while_queue_drains())
+	assert seen == [1, 2, 3, 4]
+	assert not queue._queues and not queue._workers and not queue._putting
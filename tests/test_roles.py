@@ -0,0 +1,17 @@
+# tests/test_roles.py
+"""Cached roles outlive the session of the update that loaded them."""
+import pytest
+
+from cache import role_cache
+from conftest import STUDENT_BASE_ID
+from fake_telegram import message
+
+
+@pytest.mark.parametrize("classroom", (1,), indirect=True)
+def test_rollback_does_not_expire_cached_roles(classroom, feed):
+	role_cache.clear()
+	# Already a member: the commit fails and the update's session rolls back
+	assert [method.text for method in feed(message(STUDENT_BASE_ID, "/join class"))] == ["Вы уже состоите в группе «Class»."]
+
+	sent = feed(message(STUDENT_BASE_ID, "Отправить решение"))
+	assert "Ошибка" not in sent[0].text
@@ -0,0 +1,100 @@
+# tests/test_scoping.py
+"""Homework, reviews, grading and the leaderboard stay within one teacher's students."""
+from datetime import datetime
+
+import pytest
+
+import main
+from cache import active_homeworks, group_cache
+from callbacks import DownloadSubmission, GradeSubmission, SelectSubmission, SubmitHomework
+from conftest import STUDENT_BASE_ID, TEACHER_ID
+from database import async_session
+from fake_telegram import callback, message
+from model import Group, GroupMember, Homework, Student, Teacher
+
+OTHER_TEACHER_ID = 2
+STRAY_STUDENT_ID = 3000
+
+
+async def _other_teacher():
+	async with async_session() as session:
+		teacher = Teacher(telegram_id=str(OTHER_TEACHER_ID), name="Other")
+		session.add(teacher)
+		session.add(Student(
+			telegram_id=str(STRAY_STUDENT_ID), phone_number="+3000", first_name="Stray", last_name="Student",
+			username="stray", total_points=0,
+		))
+		await session.flush()
+		session.add(Homework(description="Other homework", deadline=datetime(2099, 1, 1), teacher_id=teacher.id))
+		await session.commit()
+	await active_homeworks.refresh()
+
+
+def _texts(sent):
+	return [getattr(method, "text", None) or "" for method in sent]
+
+
+@pytest.mark.parametrize("classroom", (2,), indirect=True)
+def test_homework_without_group_reaches_only_the_teachers_students(classroom, run, feed):
+	run(_other_teacher())
+
+	texts = _texts(feed(message(STUDENT_BASE_ID, "Посмотреть домашнее задание")))
+	assert "Описание: Homework," in texts[0] and "Other homework" not in texts[0]
+	# Outside any group a student is nobody's, and is told how to join one
+	assert _texts(feed(message(STRAY_STUDENT_ID, "Посмотреть домашнее задание"))) == [
+		"Вы пока не состоите ни в одной группе. Попросите у учителя код и отправьте /join КОД."
+	]
+	# Review counts only the teacher's students
+	assert "не отправившие решения: 0" in _texts(feed(message(TEACHER_ID, "Проверить домашки")))[0]
+
+
+@pytest.mark.parametrize("classroom", (1,), indirect=True)
+def test_other_teacher_cannot_review_download_or_grade(classroom, run, feed):
+	run(_other_teacher())
+
+	sent = feed(callback(OTHER_TEACHER_ID, SelectSubmission(id=1).pack()))
+	assert not [method for method in sent if type(method).__name__ in ("SendDocument", "SendMediaGroup")]
+	assert "Решение не найдено." in _texts(sent)
+
+	sent = feed(callback(OTHER_TEACHER_ID, DownloadSubmission(id=1).pack()))
+	assert "Файл не найден." in _texts(sent)
+	assert _texts(feed(message(OTHER_TEACHER_ID, "Скачать solution_0.py"))) == ["Файл не найден."]
+
+	sent = feed(callback(OTHER_TEACHER_ID, GradeSubmission(id=1).pack()))
+	assert [getattr(method, "text", None) for method in sent] == ["Решение не найдено."]
+	assert _texts(feed(message(OTHER_TEACHER_ID, "5"))) == ["Сначала выберите решение для оценки."]
+
+
+async def _join_other_teachers_group(student_id):
+	async with async_session() as session:
+		group = Group(teacher_id=2, name="Other class", code="other")
+		session.add(group)
+		await session.flush()
+		session.add(GroupMember(group_id=group.id, student_id=student_id))
+		await session.commit()
+	group_cache.clear()
+
+
+@pytest.mark.parametrize("classroom", (1,), indirect=True)
+def test_student_of_two_teachers_picks_the_homework(classroom, run, feed):
+	run(_other_teacher())
+	run(_join_other_teachers_group(1))
+
+	sent = feed(message(STUDENT_BASE_ID, "Отправить решение"))
+	buttons = [row[0] for row in sent[0].reply_markup.inline_keyboard]
+	assert [button.text.split(" (")[0] for button in buttons] == ["Homework", "Other homework"]
+
+	feed(callback(STUDENT_BASE_ID, buttons[1].callback_data))
+	state = main.dp.fsm.get_context(main.bot, chat_id=STUDENT_BASE_ID, user_id=STUDENT_BASE_ID)
+	assert run(state.get_data())["homework_id"] == SubmitHomework.unpack(buttons[1].callback_data).id
+
+
+@pytest.mark.parametrize("classroom", (2,), indirect=True)
+def test_leaderboard_is_scoped_to_the_callers_groups(classroom, run, feed):
+	run(_other_teacher())
+
+	assert "First0 Last0" in _texts(feed(message(TEACHER_ID, "/leaderboard")))[0]
+	assert "First1 Last1" in _texts(feed(message(STUDENT_BASE_ID, "/leaderboard")))[0]
+	assert _texts(feed(message(OTHER_TEACHER_ID, "/leaderboard"))) == ["Рейтинг пока пуст."]
+	assert _texts(feed(message(STRAY_STUDENT_ID, "/leaderboard"))) == ["Рейтинг пока пуст."]
+	assert _texts(feed(message(4000, "/leaderboard"))) == ["Сначала зарегистрируйтесь: /start"]
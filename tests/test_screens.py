@@ -0,0 +1,66 @@
+# tests/test_screens.py
+"""Review, download and grading screens run a fixed number of queries whatever the class size."""
+import pytest
+
+from callbacks import DownloadSubmission, GradeSubmission, MissingPage, ReviewPage, SelectSubmission
+from conftest import STUDENT_BASE_ID, TEACHER_ID
+from fake_telegram import callback, message
+
+CLASS_SIZES = (1, 40)
+
+# Statements per screen once the role cache and the homework registry are warm
+SCREEN_QUERIES = {
+	"review": 2,
+	"review page": 2,
+	"missing page": 1,
+	"select submission": 1,
+	"download": 1,
+	"download by name": 1,
+	"grade prompt": 1,
+	"grade": 4,
+}
+
+
+def screens(homework_id):
+	submission_id = 1
+	return [
+		("review", message(TEACHER_ID, "Проверить домашки")),
+		("review page", callback(TEACHER_ID, ReviewPage(hw=homework_id, after=0).pack())),
+		("missing page", callback(TEACHER_ID, MissingPage(hw=homework_id).pack())),
+		("select submission", callback(TEACHER_ID, SelectSubmission(id=submission_id).pack())),
+		("download", callback(TEACHER_ID, DownloadSubmission(id=submission_id).pack())),
+		("download by name", message(TEACHER_ID, "Скачать solution_0.py")),
+		("grade prompt", callback(TEACHER_ID, GradeSubmission(id=submission_id).pack())),
+		("grade", message(TEACHER_ID, "5")),
+	]
+
+
+@pytest.mark.parametrize("classroom", CLASS_SIZES, indirect=True)
+def test_screen_query_counts(classroom, feed, recorder):
+	# Load the teacher into the role cache
+	feed(message(TEACHER_ID, "/start"))
+
+	counts = {}
+	for name, update in screens(classroom):
+		with recorder.record() as recording:
+			sent = feed(update)
+		assert sent, f"{name} sent nothing"
+		counts[name] = recording.count
+
+	assert counts == SCREEN_QUERIES
+
+
+@pytest.mark.parametrize("classroom", (1,), indirect=True)
+def test_screens_show_student(classroom, feed):
+	sent = feed(callback(TEACHER_ID, SelectSubmission(id=1).pack()))
+	assert any("First0 Last0" in (getattr(method, "text", None) or "") for method in sent)
+
+	sent = feed(callback(TEACHER_ID, GradeSubmission(id=1).pack()))
+	assert any("First0 Last0" in (getattr(method, "text", None) or "") for method in sent)
+
+	sent = feed(message(TEACHER_ID, "Скачать solution_0.py"))
+	assert [method.document for method in sent if type(method).__name__ == "SendDocument"] == ["file-0"]
+
+	# Only teachers download submissions
+	sent = feed(message(STUDENT_BASE_ID, "Скачать solution_0.py"))
+	assert [getattr(method, "text", None) for method in sent] == ["Вы не зарегистрированы как учитель."]
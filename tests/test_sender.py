@@ -0,0 +1,37 @@
+# tests/test_sender.py
+"""Reminder fan-outs leave room for notifications, and closing never hangs on a stuck send."""
+import asyncio
+
+from aiogram.methods import SendMessage
+
+from sender import Sender
+
+
+class StuckBot:
+	"""Never answers a call."""
+
+	async def __call__(self, method):
+		await asyncio.Event().wait()
+
+
+async def _fill_and_close():
+	sender = Sender(
+		StuckBot(), global_rate=1000, chat_rate=1000, chat_burst=1000, workers=1, queue_size=2, bulk_queue_size=3,
+	)
+	for chat_id in range(3):
+		await sender.enqueue(SendMessage(chat_id=chat_id, text="reminder"))
+	# A fourth reminder waits for a bulk place
+	fourth = asyncio.create_task(sender.enqueue(SendMessage(chat_id=3, text="reminder")))
+	await asyncio.sleep(0.01)
+	waited = not fourth.done()
+	fourth.cancel()
+
+	queued = [sender.submit(SendMessage(chat_id=10 + n, text="notification")) for n in range(3)]
+	await asyncio.wait_for(sender.close(timeout=0.05), 1)
+	return waited, queued
+
+
+def test_fan_out_leaves_room_for_notifications(run):
+	waited, queued = run(_fill_and_close())
+	assert waited
+	assert queued == [True, True, False]
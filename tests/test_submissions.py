@@ -0,0 +1,55 @@
+# tests/test_submissions.py
+"""Submitting stops at the homework's attempt limit, and a repeated finalize stores nothing new."""
+import pytest
+from sqlalchemy import func, select
+
+import main
+from conftest import STUDENT_BASE_ID
+from database import async_session
+from fake_telegram import document, message
+from model import Submission, SubmissionFile
+
+
+async def _rows():
+	async with async_session() as session:
+		submissions = await session.scalar(select(func.count()).select_from(Submission).where(Submission.student_id == 1))
+		files = await session.scalar(select(func.count()).select_from(SubmissionFile))
+	return submissions, files
+
+
+def _state():
+	return main.dp.fsm.get_context(main.bot, chat_id=STUDENT_BASE_ID, user_id=STUDENT_BASE_ID)
+
+
+def _texts(sent):
+	return [getattr(method, "text", None) for method in sent]
+
+
+def _start(feed):
+	feed(message(STUDENT_BASE_ID, "Отправить решение"))
+	feed(document(STUDENT_BASE_ID, "solution.py"))
+
+
+@pytest.mark.parametrize("classroom", (1,), indirect=True)
+def test_attempts_stop_at_the_limit(classroom, run, feed):
+	# The seeded submission is attempt 1 of the default 3
+	for _ in range(2):
+		_start(feed)
+		assert "Ваше решение успешно отправлено и сохранено." in _texts(feed(message(STUDENT_BASE_ID, "Завершить отправку")))
+
+	_start(feed)
+	assert _texts(feed(message(STUDENT_BASE_ID, "Завершить отправку"))) == ["You have used all submission attempts."]
+	assert run(_rows()) == (3, 3)
+
+
+@pytest.mark.parametrize("classroom", (1,), indirect=True)
+def test_repeated_finalize_stores_one_submission(classroom, run, feed):
+	_start(feed)
+	pending = run(_state().get_data())
+	assert "Ваше решение успешно отправлено и сохранено." in _texts(feed(message(STUDENT_BASE_ID, "Завершить отправку")))
+
+	# The same submission finalized again, e.g. a redelivered update
+	run(_state().set_data(pending))
+	assert _texts(feed(message(STUDENT_BASE_ID, "Завершить отправку"))) == ["Это решение уже отправлено."]
+	assert run(_rows()) == (2, 2)
+	assert run(_state().get_data()) == {}
@@ -0,0 +1,111 @@
+# throttling.py
+"""Per-user flood protection for incoming updates.
+
+Each handler belongs to a throttle profile, chosen with a handler flag::
+
+	@router.message(F.document, flags={"throttle": "upload"})
+
+Handlers without the flag use ``"default"``; ``flags={"throttle": False}``
+exempts a handler. Every (user, profile) pair has its own token bucket, so
+spamming one kind of action does not block the others.
+"""
+import logging
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from config import (
+	THROTTLE_RATE, THROTTLE_BURST, THROTTLE_UPLOAD_RATE, THROTTLE_UPLOAD_BURST,
+	THROTTLE_DOWNLOAD_RATE, THROTTLE_DOWNLOAD_BURST, THROTTLE_MAX_KEYS,
+)
+from sender import TokenBucket
+
+# profile -> (tokens per second, burst)
+PROFILES: Dict[str, Tuple[float, int]] = {
+	"default": (THROTTLE_RATE, THROTTLE_BURST),
+	"upload": (THROTTLE_UPLOAD_RATE, THROTTLE_UPLOAD_BURST),
+	"download": (THROTTLE_DOWNLOAD_RATE, THROTTLE_DOWNLOAD_BURST),
+}
+
+THROTTLED_TEXT = "Слишком много запросов. Подождите немного и попробуйте снова."
+
+
+class ThrottleBackend:
+	"""Where the buckets live. Implement :meth:`hit` over a shared store to limit across workers."""
+
+	async def hit(self, key: str, rate: float, burst: int) -> Tuple[bool, bool]:
+		"""Take one token for ``key``; return ``(allowed, first_rejection)``.
+
+		``first_rejection`` is true for the first rejected hit after an allowed
+		one, so the user is told once rather than on every dropped update.
+		"""
+		raise NotImplementedError
+
+
+class MemoryThrottleBackend(ThrottleBackend):
+	"""Buckets kept in this process."""
+
+	def __init__(self, max_keys: int = THROTTLE_MAX_KEYS):
+		self.max_keys = max_keys
+		self._buckets: Dict[str, TokenBucket] = {}
+		# keys currently rejecting updates
+		self._rejecting = set()
+
+	async def hit(self, key: str, rate: float, burst: int) -> Tuple[bool, bool]:
+		bucket = self._buckets.get(key)
+		if bucket is None:
+			if len(self._buckets) >= self.max_keys:
+				# A full bucket behaves like a new one, so idle users can be dropped
+				self._buckets = {k: b for k, b in self._buckets.items() if not b.is_full()}
+				self._rejecting &= self._buckets.keys()
+			bucket = self._buckets[key] = TokenBucket(rate, burst)
+
+		if bucket.try_acquire():
+			self._rejecting.discard(key)
+			return True, False
+		if key in self._rejecting:
+			return False, False
+		self._rejecting.add(key)
+		return False, True
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+	"""Inner middleware dropping updates over the user's rate before the handler's database work.
+
+	Register it ahead of the session and role middlewares, so a dropped update
+	opens no session. It still costs the FSM state reads: the dispatcher's FSM
+	middleware is an outer middleware and loads the state before any router
+	middleware runs, which is one primary-key lookup with ``FSM_STORAGE=sql``.
+	An update queued behind another update of the same user costs a second
+	one, when the ordered queue reloads the state before running it.
+	"""
+
+	def __init__(self, backend: ThrottleBackend = None, profiles: Dict[str, Tuple[float, int]] = None):
+		self.backend = backend or MemoryThrottleBackend()
+		self.profiles = profiles or PROFILES
+
+	async def __call__(
+			self,
+			handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+			event: TelegramObject,
+			data: Dict[str, Any],
+	) -> Any:
+		user = data.get("event_from_user")
+		profile = get_flag(data, "throttle", default="default")
+		if user is None or profile is False:
+			return await handler(event, data)
+
+		rate, burst = self.profiles.get(profile, self.profiles["default"])
+		allowed, first_rejection = await self.backend.hit(f"{user.id}:{profile}", rate, burst)
+		if allowed:
+			return await handler(event, data)
+
+		logging.debug("Throttled update from user %s (%s)", user.id, profile)
+		if isinstance(event, CallbackQuery):
+			# Always answer so the button stops spinning; the text only once
+			await event.answer(THROTTLED_TEXT if first_rejection else None)
+		elif first_rejection and isinstance(event, Message):
+			await event.answer(THROTTLED_TEXT)
+		return None
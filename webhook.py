@@ -0,0 +1,73 @@
+# webhook.py
+import asyncio
+import logging
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT
+
+
+async def health(request: web.Request) -> web.Response:
+	"""Liveness endpoint for the load balancer."""
+	return web.json_response({"status": "ok"})
+
+
+def build_app(dp: Dispatcher, bot: Bot) -> web.Application:
+	"""Build an aiohttp application that feeds webhook updates into the dispatcher."""
+	app = web.Application()
+	app.router.add_get("/health", health)
+
+	# Updates are only enqueued in the request (see ordering.py), so Telegram is answered
+	# once the update is queued and waits when the queues are full
+	handler = SimpleRequestHandler(
+		dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET, handle_in_background=False,
+	)
+	# Only the route: handler.register would also close the bot session on shutdown,
+	# before the dispatcher's shutdown has drained the queues that still send with it
+	app.router.add_post(WEBHOOK_PATH, handler.handle)
+	setup_application(app, dp, bot=bot)
+	return app
+
+
+async def on_startup(bot: Bot):
+	"""Register the webhook with Telegram."""
+	if not WEBHOOK_URL:
+		logging.warning("WEBHOOK_URL is not set, skipping setWebhook")
+		return
+	await bot.set_webhook(
+		f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+		secret_token=WEBHOOK_SECRET,
+		drop_pending_updates=False,
+	)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+	"""Serve webhook updates until SIGINT/SIGTERM, then shut down gracefully."""
+	if not WEBHOOK_SECRET:
+		# Without it anyone who finds the URL can post forged updates, as any user
+		raise RuntimeError("WEBHOOK_SECRET must be set to run in webhook mode")
+	dp.startup.register(on_startup)
+	app = build_app(dp, bot)
+
+	runner = web.AppRunner(app)
+	await runner.setup()
+	site = web.TCPSite(runner, host=WEBAPP_HOST, port=WEBAPP_PORT)
+	await site.start()
+	logging.info("Webhook server listening on %s:%s%s", WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH)
+
+	stop = asyncio.Event()
+	loop = asyncio.get_running_loop()
+	for sig in (signal.SIGINT, signal.SIGTERM):
+		try:
+			loop.add_signal_handler(sig, stop.set)
+		except NotImplementedError:
+			pass
+
+	try:
+		await stop.wait()
+	finally:
+		# Stops accepting new requests, then runs the dispatcher's shutdown (see main.shutdown)
+		await runner.cleanup()
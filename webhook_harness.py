@@ -0,0 +1,75 @@
+# webhook_harness.py
+"""Post canned Update JSON to a running webhook server.
+
+Usage: RUN_MODE=webhook python main.py, then
+	python webhook_harness.py [http://localhost:8080/webhook] [repeat]
+"""
+import asyncio
+import sys
+import time
+
+from aiohttp import ClientSession
+from yarl import URL
+
+from config import WEBAPP_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+
+USER = {"id": 100001, "is_bot": False, "first_name": "Test", "username": "test_student"}
+CHAT = {"id": 100001, "type": "private", "first_name": "Test"}
+
+
+def message_update(update_id: int, text: str) -> dict:
+	return {
+		"update_id": update_id,
+		"message": {
+			"message_id": update_id,
+			"date": int(time.time()),
+			"chat": CHAT,
+			"from": USER,
+			"text": text,
+			**({"entities": [{"type": "bot_command", "offset": 0, "length": len(text)}]} if text.startswith("/") else {}),
+		},
+	}
+
+
+def document_update(update_id: int, file_name: str) -> dict:
+	return {
+		"update_id": update_id,
+		"message": {
+			"message_id": update_id,
+			"date": int(time.time()),
+			"chat": CHAT,
+			"from": USER,
+			"document": {"file_id": f"file-{update_id}", "file_unique_id": f"u-{update_id}", "file_name": file_name},
+		},
+	}
+
+
+def canned_updates(start_id: int = 1) -> list:
+	return [
+		message_update(start_id, "/start"),
+		message_update(start_id + 1, "Посмотреть домашнее задание"),
+		message_update(start_id + 2, "Отправить решение"),
+		document_update(start_id + 3, "solution.py"),
+		message_update(start_id + 4, "Завершить отправку"),
+	]
+
+
+async def post_updates(url: str, repeat: int = 1):
+	headers = {"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET} if WEBHOOK_SECRET else {}
+	async with ClientSession() as http:
+		async with http.get(URL(url).with_path("/health")) as response:
+			print(f"GET /health -> {response.status}")
+
+		update_id = 1
+		for _ in range(repeat):
+			for update in canned_updates(update_id):
+				started = time.perf_counter()
+				async with http.post(url, json=update, headers=headers) as response:
+					elapsed = (time.perf_counter() - started) * 1000
+					print(f"update {update['update_id']} -> {response.status} ({elapsed:.1f} ms)")
+			update_id += 5
+
+
+if __name__ == "__main__":
+	target = sys.argv[1] if len(sys.argv) > 1 else f"http://localhost:{WEBAPP_PORT}{WEBHOOK_PATH}"
+	asyncio.run(post_updates(target, int(sys.argv[2]) if len(sys.argv) > 2 else 1))